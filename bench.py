@@ -0,0 +1,138 @@
+"""Micro-benchmarks for LiraKuBot hot paths
+
+    python bench.py [--number 20000]
+
+Each benchmark prints the best time per call over a few repeats.
+"""
+import argparse
+import os
+import tempfile
+import timeit
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+
+# main is imported for its real message functions; keep its databases out of the working directory
+_workdir = tempfile.TemporaryDirectory(prefix='lirakubot-bench-')
+os.environ.setdefault('BOT_TOKEN', '123456:BENCH')
+os.environ.setdefault('EXCHANGE_API_KEY', 'bench')
+for name in ('JOURNAL_PATH', 'PERSISTENCE_PATH', 'RATE_STORE_PATH'):
+    os.environ[name] = os.path.join(_workdir.name, 'bench.db')
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.helpers import escape_markdown
+
+import main
+from exchange import IDR_UNIT, TRY_UNIT, BuyQuote, Pricing
+from rates import RateTable
+from rendering import BACK_MENU_KEYBOARD, format_idr, markdown_text
+
+TABLE = RateTable('IDR', {'IDR': 1, 'TRY': 0.00234, 'USD': 0.0000615, 'EUR': 0.0000566})
+AMOUNTS = (100000, 500000, 1000000)
+
+
+def float_inline():
+    """The former inline math: float multiply per amount, margin as a literal"""
+    rate = TABLE.rate('IDR', 'TRY')
+    return [amount * rate * 0.975 for amount in AMOUNTS]
+
+
+def decimal_naive():
+    """The same BuyQuotes without a PriceSnapshot: every call converts the rate and applies the margin"""
+    rate = Decimal(repr(TABLE.rate('IDR', 'TRY')))
+    keep = Decimal(1) - Decimal('0.025')
+    fee = Decimal(5000)
+    quotes = []
+    for amount in AMOUNTS:
+        amount = Decimal(amount).quantize(IDR_UNIT, ROUND_HALF_UP)
+        quotes.append(BuyQuote(amount, (amount * rate * keep).quantize(TRY_UNIT, ROUND_DOWN), fee, amount + fee))
+    return quotes
+
+
+PRICING = Pricing()
+
+
+def decimal_quote_buy():
+    prices = PRICING.prices(TABLE)
+    return [prices.quote_buy(amount) for amount in AMOUNTS]
+
+
+def decimal_quote_many():
+    return PRICING.prices(TABLE).quote_many(AMOUNTS, 'buy')
+
+
+def format_currency_replace(amount=505000):
+    """The former formatter: float-style format, then replace"""
+    return f"Rp{amount:,.0f}".replace(',', '.')
+
+
+def format_idr_fast():
+    return format_idr(505000)
+
+
+def keyboard_per_call():
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔙 Kembali", callback_data="back")],
+        [InlineKeyboardButton("🏠 Menu Utama", callback_data="main_menu")]
+    ])
+
+
+def keyboard_singleton():
+    return BACK_MENU_KEYBOARD
+
+
+def markdown_escape_regex(name='Budi_Santoso'):
+    """telegram.helpers.escape_markdown, one regex substitution per call"""
+    return escape_markdown(name, version=1)
+
+
+def markdown_text_translate():
+    return markdown_text('Budi_Santoso')
+
+
+ORDER = {'name': 'Budi Santoso', 'iban': 'TR123456789012345678901234', 'amount': 500000,
+         'try_amount': Decimal('1140.75'), 'total': 505000}
+
+
+def confirmation_fstring_pieces():
+    """The former message building, without escaping the name or IBAN"""
+    return (
+        "📋 **Konfirmasi Detail Pembelian**\n\n"
+        f"👤 **Nama:** {ORDER['name']}\n"
+        f"🏦 **IBAN:** `{ORDER['iban']}`\n"
+        f"💸 **Nominal konversi:** {format_currency_replace(ORDER['amount'])}\n"
+        f"🇹🇷 **TRY yang diterima:** ₺{ORDER['try_amount']:.2f}\n"
+        f"💼 **Biaya admin:** {format_currency_replace(5000)}\n"
+        f"💰 **Total pembayaran:** {format_currency_replace(ORDER['total'])}\n\n"
+        "Apakah data sudah benar?"
+    )
+
+
+def confirmation_message():
+    """The production buy confirmation, escaping included"""
+    return main.buy_confirmation_message(**ORDER)
+
+
+BENCHMARKS = {
+    'pricing': [float_inline, decimal_naive, decimal_quote_buy, decimal_quote_many],
+    'rendering': [format_currency_replace, format_idr_fast, markdown_escape_regex, markdown_text_translate,
+                  keyboard_per_call, keyboard_singleton, confirmation_fstring_pieces, confirmation_message],
+}
+
+
+def run(groups, number, repeat=5):
+    for group in groups:
+        print(f"\n[{group}]")
+        for function in BENCHMARKS[group]:
+            best = min(timeit.repeat(function, number=number, repeat=repeat)) / number
+            print(f"  {function.__name__:<28}{best * 1e6:>9.2f} µs/call")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="LiraKuBot micro-benchmarks")
+    parser.add_argument('groups', nargs='*', default=list(BENCHMARKS), help="benchmark groups to run")
+    parser.add_argument('--number', type=int, default=20000, help="calls per repeat")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run(args.groups, args.number)
@@ -0,0 +1,302 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import sys
+from collections import OrderedDict
+
+import httpx
+
+import metrics
+from webserver import WebServer, Response, json_response, text_response
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_FORWARDS = metrics.REGISTRY.register(metrics.Counter(
+    'lirakubot_cluster_forwards_total', 'Updates forwarded by the cluster front-end', ('worker', 'result')
+))
+CLUSTER_WORKER_UP = metrics.REGISTRY.register(metrics.Gauge(
+    'lirakubot_cluster_worker_up', 'Whether the front-end routes updates to a worker (1) or skips it (0)', ('worker',)
+))
+CLUSTER_RESTARTS = metrics.REGISTRY.register(metrics.Counter(
+    'lirakubot_cluster_worker_restarts_total', 'Local worker processes restarted after exiting', ('worker',)
+))
+
+# Set on an update whose user was last served by a different worker, which must reload the user's state first
+HANDOFF_HEADER = 'x-lirakubot-handoff'
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hash ring that maps routing keys to nodes
+
+    Each node is placed on the ring ``replicas`` times so keys spread evenly.
+    Adding or removing a node only moves the keys of the ring segments it
+    owns; every other key keeps its node.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        if not nodes:
+            raise ValueError("HashRing needs at least one node")
+        self.nodes = list(nodes)
+        points = sorted((ring_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key):
+        i = bisect.bisect(self._hashes, ring_hash(key))
+        return self._owners[i % len(self._owners)]
+
+    def nodes_for(self, key):
+        """Every node in the order met walking the ring from ``key``
+
+        Skipping the first nodes of this list routes ``key`` exactly as a ring
+        without those nodes would, so dropping a node only moves its own keys.
+        """
+        start = bisect.bisect(self._hashes, ring_hash(key))
+        seen = []
+        for i in range(start, start + len(self._owners)):
+            node = self._owners[i % len(self._owners)]
+            if node not in seen:
+                seen.append(node)
+                if len(seen) == len(self.nodes):
+                    break
+        return seen
+
+
+def routing_key(payload):
+    """User id of a raw update payload, else its chat id, else the update id
+
+    Works on the JSON dict so the front-end never builds ``Update`` objects.
+    """
+    for field, value in payload.items():
+        if field == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            return user['id']
+        chat = value.get('chat') or value.get('message', {}).get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+    return payload.get('update_id')
+
+
+class ClusterFrontend:
+    """Public webhook endpoint that forwards every update to the worker owning its user
+
+    Updates are routed by ``routing_key`` over a HashRing of worker base URLs,
+    so all updates of a user reach the same worker in the order Telegram
+    delivers them. Every ``check_interval`` seconds each worker's ``/health``
+    is polled; a worker that fails the check, or refuses a connection, is
+    dropped from the ring and its users go to the next worker on the ring
+    until a later check finds it healthy again. An update that was sent to a
+    worker but not answered with 200 is not retried elsewhere, since the
+    worker may have handled it: it is answered with 502 and redelivered by
+    Telegram.
+
+    The last worker of each of the ``max_tracked`` most recent users is kept;
+    an update sent to a different worker carries ``HANDOFF_HEADER`` so that
+    worker reloads the user's state from the store it shares with the others.
+    """
+
+    def __init__(self, workers, secret, path, host, port, timeout=10.0, health=None,
+                 check_interval=5.0, check_timeout=2.0, max_tracked=100000):
+        self.workers = list(workers)
+        self.ring = HashRing(self.workers)
+        self.down = set()  # workers currently dropped from the ring
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.max_tracked = max_tracked
+        self._last_worker = OrderedDict()  # routing key -> worker that last took one of its updates
+        self._checker = None
+        self.secret = secret
+        self.path = path
+        self.timeout = timeout
+        self.health = health  # optional callable adding fields to /health
+        self.server = WebServer(host, port)
+        self._client = None
+
+        self.server.route('GET', '/', self._home)
+        self.server.route('GET', '/health', self._health)
+        self.server.route('GET', '/metrics', self._metrics)
+        self.server.route('POST', path, self._forward)
+
+    async def start(self):
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=64 * len(self.workers), max_keepalive_connections=16 * len(self.workers))
+        )
+        for worker in self.workers:
+            CLUSTER_WORKER_UP.set(1, worker=worker)
+        await self.server.start()
+        self._checker = asyncio.create_task(self._check_workers())
+
+    async def stop(self):
+        if self._checker is not None:
+            self._checker.cancel()
+            await asyncio.gather(self._checker, return_exceptions=True)
+            self._checker = None
+        await self.server.stop()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _mark(self, worker, healthy):
+        if healthy and worker in self.down:
+            self.down.discard(worker)
+            logger.info(f"Cluster worker {worker} is healthy again, back on the ring")
+        elif not healthy and worker not in self.down:
+            self.down.add(worker)
+            logger.warning(f"Cluster worker {worker} is unreachable, dropped from the ring")
+        CLUSTER_WORKER_UP.set(0 if worker in self.down else 1, worker=worker)
+
+    async def _check(self, worker):
+        try:
+            response = await self._client.get(worker + '/health', timeout=self.check_timeout)
+            healthy = response.status_code == 200
+        except httpx.HTTPError:
+            healthy = False
+        self._mark(worker, healthy)
+
+    async def _check_workers(self):
+        while True:
+            # Sleep first so workers started together with the front-end have time to come up
+            await asyncio.sleep(self.check_interval)
+            await asyncio.gather(*(self._check(worker) for worker in self.workers))
+
+    def _route(self, key):
+        """Workers to try for ``key``, healthy ones in ring order; all of them if none is healthy"""
+        nodes = self.ring.nodes_for(key)
+        return [node for node in nodes if node not in self.down] or nodes
+
+    async def _home(self, request):
+        return text_response("LiraKuBot is alive!")
+
+    async def _health(self, request):
+        status = {"status": "healthy", "bot": "LiraKuBot", "role": "frontend", "workers": self.workers,
+                  "workers_down": sorted(self.down)}
+        if self.health:
+            status.update(self.health())
+        return json_response(status)
+
+    async def _metrics(self, request):
+        return Response(200, metrics.CONTENT_TYPE, metrics.REGISTRY.render().encode())
+
+    async def _forward(self, request):
+        if request.headers.get('x-telegram-bot-api-secret-token') != self.secret:
+            return text_response('Forbidden', 403)
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            return text_response('Bad Request', 400)
+        if not isinstance(payload, dict):
+            return text_response('Bad Request', 400)
+
+        key = routing_key(payload)
+        workers = self._route(key)
+        # A user not seen since this front-end started was last on its own worker
+        last = self._last_worker.get(key, self.ring.node_for(key))
+        for worker in workers:
+            headers = {'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': self.secret}
+            if worker != last:
+                headers[HANDOFF_HEADER] = '1'
+            try:
+                with metrics.outbound('cluster_worker', 'forward'):
+                    response = await self._client.post(worker + self.path, content=request.body, headers=headers)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # The update never reached this worker, so the next one on the ring can take it
+                CLUSTER_FORWARDS.inc(worker=worker, result='unreachable')
+                logger.warning(f"Could not connect to {worker} for update {payload.get('update_id')}: {e}")
+                self._mark(worker, False)
+                continue
+            except httpx.HTTPError as e:
+                CLUSTER_FORWARDS.inc(worker=worker, result='error')
+                logger.warning(f"Could not forward update {payload.get('update_id')} to {worker}: {e}")
+                return text_response('Bad Gateway', 502)
+
+            CLUSTER_FORWARDS.inc(worker=worker, result=str(response.status_code))
+            if response.status_code != 200:
+                return text_response('Bad Gateway', 502)
+            self._last_worker[key] = worker
+            self._last_worker.move_to_end(key)
+            if len(self._last_worker) > self.max_tracked:
+                self._last_worker.popitem(last=False)
+            return text_response('OK')
+        return text_response('Bad Gateway', 502)
+
+
+class WorkerSupervisor:
+    """Runs the local bot worker processes and restarts any that exit
+
+    Worker ``slot`` listens on ``base_port + slot`` on localhost and gets
+    ``CLUSTER_ROLE=worker`` and ``CLUSTER_SLOT`` in its environment. A
+    restarted worker keeps its slot and port, so it keeps its place on the
+    hash ring and reloads its users' state from the shared store.
+    """
+
+    def __init__(self, script, count, base_port, env, host='127.0.0.1', max_backoff=30.0):
+        self.script = script
+        self.count = count
+        self.base_port = base_port
+        self.env = env
+        self.host = host
+        self.max_backoff = max_backoff
+        self._processes = {}
+        self._tasks = []
+        self._stopping = False
+
+    @property
+    def urls(self):
+        return [f"http://{self.host}:{self.base_port + slot}" for slot in range(self.count)]
+
+    def alive(self):
+        return sum(1 for process in self._processes.values() if process.returncode is None)
+
+    async def start(self):
+        for slot in range(self.count):
+            self._tasks.append(asyncio.create_task(self._keep_running(slot)))
+
+    async def _spawn(self, slot):
+        env = {**self.env, 'CLUSTER_ROLE': 'worker', 'CLUSTER_SLOT': str(slot),
+               'WORKER_HOST': self.host, 'PORT': str(self.base_port + slot)}
+        process = await asyncio.create_subprocess_exec(sys.executable, self.script, env=env)
+        self._processes[slot] = process
+        logger.info(f"Started cluster worker {slot} (pid {process.pid}) on port {self.base_port + slot}")
+        return process
+
+    async def _keep_running(self, slot):
+        backoff = 1.0
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            started = loop.time()
+            process = await self._spawn(slot)
+            code = await process.wait()
+            if self._stopping:
+                return
+            # A worker that ran for a while starts over with a short backoff
+            backoff = 1.0 if loop.time() - started > self.max_backoff else min(backoff * 2, self.max_backoff)
+            CLUSTER_RESTARTS.inc(worker=str(slot))
+            logger.error(f"Cluster worker {slot} exited with code {code}, restarting in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+
+    async def stop(self, timeout=30.0):
+        """Terminate all workers, giving them ``timeout`` seconds to flush and exit"""
+        self._stopping = True
+        for process in self._processes.values():
+            if process.returncode is None:
+                process.terminate()
+        for process in self._processes.values():
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Cluster worker pid {process.pid} did not exit in time, killing it")
+                process.kill()
+                await process.wait()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
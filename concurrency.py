@@ -0,0 +1,113 @@
+import asyncio
+import logging
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update):
+    """Ordering key of an update: its chat, or its user for chat-less updates"""
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return ('chat', chat.id)
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return ('user', user.id)
+    return None
+
+
+class _KeyLock:
+    __slots__ = ('lock', 'users')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Process updates of different chats concurrently, and of one chat in order
+
+    Updates that share a key (see ``chat_key``) run one at a time in arrival
+    order, so conversation state transitions of a chat never interleave.
+    Updates of other chats run alongside, up to ``max_concurrent_updates`` in
+    total.
+
+    The chat lock is taken *before* a concurrency slot: a chat that sends a
+    burst of updates queues behind its own lock instead of occupying every
+    slot while it waits, which would stall all other chats. PTB's
+    ``process_update`` holds its own slot for the whole of
+    ``do_process_update``, chat wait included, so that bound is set to
+    ``max_admitted`` and the handler limit is a separate semaphore taken
+    after the chat lock.
+    """
+
+    __slots__ = ('limit', '_slots', '_locks', '_waiting', '_active')
+
+    def __init__(self, max_concurrent_updates=64, max_admitted=4096):
+        super().__init__(max(max_admitted, max_concurrent_updates))
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks = {}
+        self._waiting = 0
+        self._active = 0
+
+    @property
+    def active(self):
+        """Updates currently being handled"""
+        return self._active
+
+    @property
+    def waiting(self):
+        """Updates waiting for an earlier update of their chat or for a free slot"""
+        return self._waiting
+
+    async def do_process_update(self, update, coroutine):
+        key = chat_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _KeyLock()
+        entry.users += 1
+        try:
+            self._waiting += 1
+            try:
+                await entry.lock.acquire()
+            except BaseException:
+                coroutine.close()
+                raise
+            finally:
+                self._waiting -= 1
+            try:
+                await self._run(coroutine)
+            finally:
+                entry.lock.release()
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._locks[key]
+
+    async def _run(self, coroutine):
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            coroutine.close()
+            raise
+        finally:
+            self._waiting -= 1
+        self._active += 1
+        try:
+            await coroutine
+        finally:
+            self._active -= 1
+            self._slots.release()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
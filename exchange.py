@@ -1,21 +1,135 @@
-import requests
-from config import MARGIN_PERCENT
-
-def get_exchange_rate():
-    url = "https://v6.exchangerate-api.com/v6/b7dae8052fd7953bf7c7f66e/latest/IDR"
-    res = requests.get(url)
-    data = res.json()
-    rate = data["conversion_rates"]["TRY"]
-    return rate
-
-def convert_idr_to_try(nominal_rp):
-    rate = get_exchange_rate()
-    margin = (MARGIN_PERCENT / 100) * nominal_rp
-    bersih = nominal_rp - margin
-    return int(bersih * get_exchange_rate())
-
-def convert_try_to_idr(nominal_try):
-    rate = get_exchange_rate()
-    idr = nominal_try / rate
-    margin = (MARGIN_PERCENT / 100) * idr
-    return int(idr - margin)
\ No newline at end of file
+import re
+from collections import namedtuple
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+
+# Smallest unit shown to users for each currency
+IDR_UNIT = Decimal('1')
+TRY_UNIT = Decimal('0.01')
+
+BuyQuote = namedtuple('BuyQuote', 'amount_idr try_amount admin_fee total_payment')
+SellQuote = namedtuple('SellQuote', 'amount_try idr_gross admin_fee idr_net')
+
+
+def to_decimal(value):
+    """Exact Decimal for ints, strings and Decimals; floats go through their shortest repr"""
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return Decimal(value)
+
+
+_AMOUNT = re.compile(r'\d[\d.,]*')
+
+
+def parse_amount(text):
+    """Amount as typed by a user or copied from a bot message, in either currency
+
+    Dots and commas both work. The last one is the decimal separator unless
+    exactly three digits follow it, and any others separate thousands:
+    ``100,5`` and ``100.50`` are decimals, while ``1.000``, ``1,000.00`` and
+    ``1.000,50`` are a thousand and more. Signs, exponents, a repeated
+    decimal separator (``1.5.5``) and thousands groups that are not three
+    digits long are rejected.
+    """
+    text = text.strip()
+    if not _AMOUNT.fullmatch(text):
+        raise ValueError(f"Invalid amount: {text!r}")
+    whole, separator, tail = max(text.rpartition('.'), text.rpartition(','), key=lambda parts: len(parts[0]))
+    if not separator or len(tail) == 3:
+        whole, separator, tail = text, '', ''
+    elif separator in whole:
+        raise ValueError(f"Invalid amount: {text!r}")
+    groups = whole.replace(',', '.').split('.')
+    leading = groups[0]
+    thousands = groups[1:]
+    if not leading or thousands and (len(leading) > 3 or leading[0] == '0' or any(len(g) != 3 for g in thousands)):
+        raise ValueError(f"Invalid amount: {text!r}")
+    return Decimal(f"{''.join(groups)}.{tail}" if tail else ''.join(groups))
+
+
+def has_fraction(amount):
+    """Whether a parsed amount has a non-zero fractional part, e.g. ``2500,50`` but not ``500.000,00``"""
+    return amount != amount.to_integral_value()
+
+
+def parse_idr(text):
+    """Rupiah amount as typed by a user; a zero fraction such as ``,00`` is dropped, any other is an error"""
+    amount = parse_amount(text)
+    if has_fraction(amount):
+        raise ValueError(f"Rupiah amount with a fraction: {text!r}")
+    return int(amount)
+
+
+def parse_try(text):
+    """Lira amount as typed by a user, see ``parse_amount``"""
+    return parse_amount(text)
+
+
+class Pricing:
+    """Margin and admin fee applied to every conversion
+
+    The margin is folded into one multiplier per direction when a rate
+    snapshot is priced (see ``prices``), so a quote is a single Decimal
+    multiply and quantize.
+    """
+
+    def __init__(self, margin='0.025', admin_fee=5000):
+        self.margin = to_decimal(margin)
+        self.admin_fee = to_decimal(admin_fee).quantize(IDR_UNIT)
+        self.keep = Decimal(1) - self.margin
+        self._last = None  # (table, PriceSnapshot) for the most recent rate table
+
+    def prices(self, table):
+        """PriceSnapshot for a RateTable; reused while the table is unchanged"""
+        if table is None:
+            return None
+        last = self._last
+        if last is not None and last[0] is table:
+            return last[1]
+        idr_to_try = table.rate('IDR', 'TRY')
+        if not idr_to_try:
+            return None
+        # Invert in Decimal: the float inverse would make exact amounts land just below a whole rupiah
+        idr_to_try = to_decimal(idr_to_try)
+        snapshot = PriceSnapshot(
+            idr_to_try * self.keep,
+            self.keep / idr_to_try,
+            self.admin_fee,
+            table.fetched_at
+        )
+        self._last = (table, snapshot)
+        return snapshot
+
+
+class PriceSnapshot:
+    """Quotes for one rate snapshot, with margin already applied to the factors
+
+    Amounts paid out to the customer are rounded down to the smallest unit,
+    so a quote never promises more than the margin allows.
+    """
+
+    __slots__ = ('buy_factor', 'sell_factor', 'admin_fee', 'fetched_at')
+
+    def __init__(self, buy_factor, sell_factor, admin_fee, fetched_at):
+        self.buy_factor = buy_factor    # TRY received per IDR converted
+        self.sell_factor = sell_factor  # IDR received per TRY sent
+        self.admin_fee = admin_fee
+        self.fetched_at = fetched_at
+
+    def quote_buy(self, amount_idr):
+        """Customer converts ``amount_idr`` rupiah into lira"""
+        amount = to_decimal(amount_idr).quantize(IDR_UNIT, ROUND_HALF_UP)
+        try_amount = (amount * self.buy_factor).quantize(TRY_UNIT, ROUND_DOWN)
+        return BuyQuote(amount, try_amount, self.admin_fee, amount + self.admin_fee)
+
+    def quote_sell(self, amount_try):
+        """Customer sends ``amount_try`` lira and receives rupiah"""
+        amount = to_decimal(amount_try).quantize(TRY_UNIT, ROUND_HALF_UP)
+        gross = (amount * self.sell_factor).quantize(IDR_UNIT, ROUND_DOWN)
+        return SellQuote(amount, gross, self.admin_fee, gross - self.admin_fee)
+
+    def quote_many(self, amounts, side='buy'):
+        """Quotes for several amounts in one direction (``'buy'`` or ``'sell'``)"""
+        quote = self.quote_buy if side == 'buy' else self.quote_sell
+        return [quote(amount) for amount in amounts]
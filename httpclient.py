@@ -0,0 +1,68 @@
+import asyncio
+import importlib.util
+import logging
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# httpx speaks HTTP/2 when the optional h2 package is installed (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+class HttpClient:
+    """Shared pooled async HTTP client for the bot's outbound calls
+
+    One ``httpx.AsyncClient`` keeps connections alive across calls, so a
+    request to a host that was used recently skips DNS, TCP and TLS setup,
+    and it negotiates HTTP/2 when available. Every call gets the same
+    connect/read timeouts, and at most ``max_per_host`` requests run against
+    one host at a time.
+
+    The underlying client is created on first use, inside the running event
+    loop; ``aclose`` closes it.
+    """
+
+    def __init__(self, timeout=10.0, connect_timeout=5.0, max_connections=100, max_per_host=10,
+                 keepalive_expiry=60.0, http2=HTTP2_AVAILABLE):
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.max_per_host = max_per_host
+        self.http2 = http2
+        self._client = None
+        self._hosts = {}  # host -> asyncio.Semaphore
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, http2=self.http2)
+            logger.info(f"Shared HTTP client created (HTTP/2 {'on' if self.http2 else 'off'})")
+        return self._client
+
+    def _host_slots(self, url):
+        host = urlsplit(url).netloc
+        slots = self._hosts.get(host)
+        if slots is None:
+            slots = self._hosts[host] = asyncio.Semaphore(self.max_per_host)
+        return slots
+
+    async def request(self, method, url, **kwargs):
+        """Send a request and return the ``httpx.Response``; error statuses are not raised here"""
+        async with self._host_slots(url):
+            return await self.client.request(method, url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,176 @@
+import re
+from collections import OrderedDict
+from datetime import datetime
+from decimal import ROUND_HALF_UP
+
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+
+import metrics
+from exchange import TRY_UNIT, has_fraction, parse_amount
+from rendering import format_idr
+
+INLINE_QUERIES = metrics.REGISTRY.register(metrics.Counter(
+    'lirakubot_inline_queries_total', 'Inline queries answered', ('result',)
+))
+
+# Amounts quoted up front for every rate snapshot; the empty query shows the OVERVIEW ones
+BUY_AMOUNTS = (100000, 200000, 250000, 300000, 500000, 750000, 1000000, 1500000, 2000000,
+               2500000, 3000000, 5000000, 10000000)
+SELL_AMOUNTS = (50, 100, 150, 200, 250, 300, 500, 750, 1000, 1500, 2000, 2500, 3000, 5000)
+OVERVIEW = (('buy', 100000), ('buy', 500000), ('buy', 1000000),
+            ('sell', 100), ('sell', 500), ('sell', 1000))
+
+HINTS = {'rp': 'buy', 'idr': 'buy', '₺': 'sell', 'try': 'sell', 'tl': 'sell', 'lira': 'sell'}
+_QUERY = re.compile(
+    r'(?P<before>rp|idr|₺|try|tl|lira)?\s*(?P<amount>\d[\d.,]{0,18})\s*(?P<after>rp|idr|₺|try|tl|lira)?',
+    re.IGNORECASE
+)
+
+
+def buy_title(amount, try_amount):
+    return f"💸 Beli Lira: {format_idr(amount)} → ₺{try_amount:.2f}"
+
+
+def buy_description(total, fee):
+    return f"Total bayar {format_idr(total)} (termasuk biaya admin {format_idr(fee)})"
+
+
+def buy_text(amount, try_amount, fee, total, time):
+    return (
+        "💸 **Beli Lira di LiraKuBot**\n\n"
+        f"💱 Nominal konversi: {format_idr(amount)}\n"
+        f"🇹🇷 TRY diterima: ₺{try_amount:.2f}\n"
+        f"💼 Biaya admin: {format_idr(fee)}\n"
+        f"💰 Total pembayaran: {format_idr(total)}\n\n"
+        f"*Update kurs: {time}*"
+    )
+
+
+def sell_title(amount, gross):
+    return f"💵 Jual Lira: ₺{amount:.2f} → {format_idr(gross)}"
+
+
+def sell_description(net, fee):
+    return f"Diterima {format_idr(net)} setelah biaya admin {format_idr(fee)}"
+
+
+def sell_text(amount, gross, fee, net, time):
+    return (
+        "💵 **Jual Lira di LiraKuBot**\n\n"
+        f"🇹🇷 TRY dikirim: ₺{amount:.2f}\n"
+        f"💱 Nilai konversi: {format_idr(gross)}\n"
+        f"💼 Biaya admin: {format_idr(fee)}\n"
+        f"💰 IDR diterima: {format_idr(net)}\n\n"
+        f"*Update kurs: {time}*"
+    )
+
+
+def parse_query(text, min_buy):
+    """``(side, amount)`` for an inline query such as ``500000``, ``Rp 500.000`` or ``250 TL``
+
+    ``Rp``/``IDR`` asks for a purchase and ``₺``/``TRY``/``TL``/``lira`` for a
+    sale. A bare number is a sale in lira if it has a fraction (``2500,50``)
+    or is below ``min_buy``, and a purchase in rupiah otherwise. Returns None
+    for anything that is not an amount.
+    """
+    match = _QUERY.fullmatch(text.strip())
+    if match is None:
+        return None
+    hints = {HINTS[hint.lower()] for hint in (match['before'], match['after']) if hint}
+    if len(hints) > 1:
+        return None
+    try:
+        amount = parse_amount(match['amount'])
+    except ValueError:
+        return None
+    if hints:
+        side = hints.pop()
+    else:
+        side = 'sell' if has_fraction(amount) or amount < min_buy else 'buy'
+    if side == 'buy':
+        # Rupiah has no cents; a zero fraction such as Rp 500.000,00 is dropped
+        return ('buy', int(amount)) if amount >= min_buy and not has_fraction(amount) else None
+    amount = amount.quantize(TRY_UNIT, ROUND_HALF_UP)
+    return ('sell', amount) if amount > 0 else None
+
+
+class InlineQuoteTable:
+    """Inline query answers for one PriceSnapshot
+
+    Results for ``buy_amounts``, ``sell_amounts`` and the empty query are
+    built when the table is created. Any other amount is quoted with the
+    snapshot's Decimal math on first use and its result kept, up to
+    ``max_cached`` amounts in least recently used order. Answering never
+    touches the rate API; a new snapshot gets a new table.
+    """
+
+    def __init__(self, prices, min_buy, buy_amounts=BUY_AMOUNTS, sell_amounts=SELL_AMOUNTS,
+                 overview=OVERVIEW, max_cached=1024):
+        self.prices = prices
+        self.min_buy = min_buy
+        self.max_cached = max_cached
+        self.time = datetime.fromtimestamp(prices.fetched_at).strftime('%H:%M %d/%m/%Y')
+        self.version = int(prices.fetched_at)
+
+        self._results = {}
+        for quote in prices.quote_many(buy_amounts, 'buy'):
+            self._results[('buy', int(quote.amount_idr))] = (self._buy_result(quote),)
+        for quote in prices.quote_many(sell_amounts, 'sell'):
+            self._results[('sell', quote.amount_try)] = (self._sell_result(quote),)
+        self.overview = tuple(self._results[key][0] for key in overview)
+        self._cached = OrderedDict()
+
+    def answer(self, query):
+        """Results for the text of an inline query"""
+        if not query.strip():
+            INLINE_QUERIES.inc(result='overview')
+            return self.overview
+        key = parse_query(query, self.min_buy)
+        if key is None:
+            INLINE_QUERIES.inc(result='invalid')
+            return self.overview
+        return self._lookup(key)
+
+    def _lookup(self, key):
+        results = self._results.get(key)
+        if results is not None:
+            INLINE_QUERIES.inc(result='table')
+            return results
+
+        results = self._cached.get(key)
+        if results is not None:
+            self._cached.move_to_end(key)
+            INLINE_QUERIES.inc(result='cached')
+            return results
+
+        side, amount = key
+        if side == 'buy':
+            results = (self._buy_result(self.prices.quote_buy(amount)),)
+        else:
+            quote = self.prices.quote_sell(amount)
+            # Too little lira to cover the admin fee
+            results = (self._sell_result(quote),) if quote.idr_net > 0 else self.overview
+        INLINE_QUERIES.inc(result='computed')
+        self._cached[key] = results
+        if len(self._cached) > self.max_cached:
+            self._cached.popitem(last=False)
+        return results
+
+    def _buy_result(self, quote):
+        fields = dict(amount=quote.amount_idr, try_amount=quote.try_amount, fee=quote.admin_fee,
+                      total=quote.total_payment)
+        return InlineQueryResultArticle(
+            id=f"buy-{quote.amount_idr}-{self.version}",
+            title=buy_title(amount=quote.amount_idr, try_amount=quote.try_amount),
+            description=buy_description(total=quote.total_payment, fee=quote.admin_fee),
+            input_message_content=InputTextMessageContent(buy_text(time=self.time, **fields), parse_mode='Markdown')
+        )
+
+    def _sell_result(self, quote):
+        fields = dict(amount=quote.amount_try, gross=quote.idr_gross, fee=quote.admin_fee, net=quote.idr_net)
+        return InlineQueryResultArticle(
+            id=f"sell-{quote.amount_try}-{self.version}",
+            title=sell_title(amount=quote.amount_try, gross=quote.idr_gross),
+            description=sell_description(net=quote.idr_net, fee=quote.admin_fee),
+            input_message_content=InputTextMessageContent(sell_text(time=self.time, **fields), parse_mode='Markdown')
+        )
@@ -0,0 +1,169 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Positions in a transaction row (same order as SHEET_HEADERS in main.py)
+ROW_TIME, ROW_STATUS, ROW_USER_ID, ROW_KIND = 0, 5, 7, 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    row TEXT NOT NULL,
+    synced INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Columns added after the first journal release, filled from the row on insert
+INDEXED_COLUMNS = (
+    ('user_id', 'TEXT'),
+    ('status', 'TEXT'),
+    ('kind', 'TEXT'),
+    ('waktu', 'TEXT'),
+)
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS journal_unsynced ON journal (id) WHERE synced = 0;
+CREATE INDEX IF NOT EXISTS journal_user ON journal (user_id, created_at);
+CREATE INDEX IF NOT EXISTS journal_status_created ON journal (status, created_at);
+CREATE INDEX IF NOT EXISTS journal_status ON journal (status, kind, created_at);
+"""
+
+
+class TransactionJournal:
+    """Append-only local transaction store (SQLite in WAL mode)
+
+    Every row is committed with ``synchronous=FULL`` so it is fsynced to disk
+    before ``append`` returns. Rows stay marked unsynced until they have been
+    written to Google Sheets, and ``unsynced`` yields them for replay after a
+    restart or an outage.
+
+    Processes sharing the file (cluster workers) each pass their own
+    ``owner`` slot. A row is replayed only by the slot that wrote it, so a
+    restarting process never queues rows that another live process is
+    still retrying.
+
+    User ID, status, type and timestamp are also stored as indexed columns so
+    admin and user lookups never need the sheet. Queries use a separate
+    read connection, which WAL lets run alongside writes.
+    """
+
+    def __init__(self, path, owner=0):
+        self.path = path
+        self.owner = owner
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._conn.executescript(INDEXES)
+
+        self._read_lock = threading.Lock()
+        self._reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+
+    def _migrate(self):
+        # One transaction holding the write lock, so processes opening the file together migrate it once
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = {info[1] for info in self._conn.execute("PRAGMA table_info(journal)")}
+            missing = [(name, kind) for name, kind in INDEXED_COLUMNS if name not in existing]
+            for name, kind in missing:
+                self._conn.execute(f"ALTER TABLE journal ADD COLUMN {name} {kind}")
+            if missing:
+                self._backfill()
+            if 'owner' not in existing:
+                # Rows written before ownership was recorded stay NULL and belong to slot 0
+                self._conn.execute("ALTER TABLE journal ADD COLUMN owner INTEGER")
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _backfill(self):
+        rows = self._conn.execute("SELECT id, row FROM journal").fetchall()
+        for entry_id, row in rows:
+            try:
+                values = self._indexed_values(json.loads(row))
+            except (IndexError, TypeError, ValueError):
+                logger.warning(f"Journal entry {entry_id} has an unexpected row layout, not indexed")
+                continue
+            self._conn.execute(
+                "UPDATE journal SET user_id = ?, status = ?, kind = ?, waktu = ? WHERE id = ?",
+                (*values, entry_id)
+            )
+        logger.info(f"Indexed {len(rows)} existing journal entries")
+
+    @staticmethod
+    def _indexed_values(row):
+        return (str(row[ROW_USER_ID]), row[ROW_STATUS], row[ROW_KIND], row[ROW_TIME])
+
+    def append(self, row):
+        """Durably store a row and return its journal id"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO journal (created_at, row, user_id, status, kind, waktu, owner) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), json.dumps(row, ensure_ascii=False), *self._indexed_values(row), self.owner)
+            )
+            return cursor.lastrowid
+
+    def mark_synced(self, entry_ids):
+        """Record that these entries have reached Google Sheets"""
+        if not entry_ids:
+            return
+        placeholders = ','.join('?' * len(entry_ids))
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE journal SET synced = 1 WHERE id IN ({placeholders})",
+                list(entry_ids)
+            )
+
+    def unsynced(self):
+        """Return this owner's ``(id, row)`` pairs not yet written to Sheets, oldest first"""
+        if self.owner == 0:
+            return self._select("WHERE synced = 0 AND (owner = 0 OR owner IS NULL) ORDER BY id", ())
+        return self._select("WHERE synced = 0 AND owner = ? ORDER BY id", (self.owner,))
+
+    def by_user(self, user_id, limit=10):
+        """Latest transactions of one Telegram user, newest first"""
+        return self._select(
+            "WHERE user_id = ? ORDER BY created_at DESC LIMIT ?", (str(user_id), limit)
+        )
+
+    def by_status(self, status, kind=None, limit=50):
+        """Latest transactions with a status (optionally of one type), newest first"""
+        if kind is None:
+            return self._select(
+                "WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit)
+            )
+        return self._select(
+            "WHERE status = ? AND kind = ? ORDER BY created_at DESC LIMIT ?", (status, kind, limit)
+        )
+
+    def set_status(self, entry_id, status):
+        """Change the status of a journaled transaction; False if there is no such entry"""
+        with self._lock:
+            found = self._conn.execute("SELECT row FROM journal WHERE id = ?", (entry_id,)).fetchone()
+            if found is None:
+                return False
+            row = json.loads(found[0])
+            row[ROW_STATUS] = status
+            self._conn.execute(
+                "UPDATE journal SET status = ?, row = ? WHERE id = ?",
+                (status, json.dumps(row, ensure_ascii=False), entry_id)
+            )
+            return True
+
+    def _select(self, clause, params):
+        with self._read_lock:
+            rows = self._reader.execute(f"SELECT id, row FROM journal {clause}", params).fetchall()
+        return [(entry_id, json.loads(row)) for entry_id, row in rows]
+
+    def close(self):
+        with self._lock, self._read_lock:
+            self._reader.close()
+            self._conn.close()
@@ -0,0 +1,254 @@
+"""Offline load test for LiraKuBot
+
+Replays synthetic Telegram updates for complete buy and sell conversations
+through the real Application (handlers, conversation states, persistence,
+journal and write-behind queue). The Bot API, exchangerate-api and Google
+Sheets are replaced by local stand-ins with configurable latency, so no
+network access or credentials are needed.
+
+    python loadtest.py --users 200 --telegram-latency 0.05 --sheets-latency 0.5
+
+Reports overall throughput and p50/p99 latency per conversation step, where
+latency is measured from putting the update on the update queue until every
+handler group has finished with it.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+# Removed when the run ends (see the bottom of this file)
+_workdir = tempfile.TemporaryDirectory(prefix='lirakubot-loadtest-')
+os.environ.setdefault('BOT_TOKEN', '123456:LOADTEST')
+os.environ.setdefault('EXCHANGE_API_KEY', 'loadtest')
+os.environ.setdefault('ADMIN_CHAT_ID', '1')
+os.environ.setdefault('PROFILE_MODE', 'off')
+os.environ['JOURNAL_PATH'] = os.path.join(_workdir.name, 'loadtest.db')
+os.environ['PERSISTENCE_PATH'] = os.path.join(_workdir.name, 'loadtest.db')
+os.environ['RATE_STORE_PATH'] = os.path.join(_workdir.name, 'loadtest.db')
+for name in ('CLUSTER_WORKERS', 'CLUSTER_NODES', 'CLUSTER_ROLE', 'CLUSTER_SLOT'):
+    os.environ.pop(name, None)
+os.environ.pop('WEBHOOK_URL', None)
+
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import BaseRequest
+
+import main
+from rates import RateTable
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'LiraKuBot', 'username': 'LiraKuBot'}
+
+BUY_FLOW = [
+    ('start', 'message', '/start'),
+    ('buy_lira', 'callback', 'buy_lira'),
+    ('buy_amount', 'message', '500000'),
+    ('buy_name', 'message', 'Budi Santoso'),
+    ('buy_iban', 'message', 'TR123456789012345678901234'),
+    ('buy_confirm', 'callback', 'confirm_transaction'),
+    ('payment_sent', 'callback', 'payment_sent'),
+]
+
+SELL_FLOW = [
+    ('start', 'message', '/start'),
+    ('sell_lira', 'callback', 'sell_lira'),
+    ('sell_amount', 'message', '150'),
+    ('sell_name', 'message', 'Budi Santoso'),
+    ('sell_account', 'message', 'BCA - 1234567890'),
+    ('sell_confirm', 'callback', 'confirm_transaction'),
+    ('sell_sent', 'callback', 'sell_sent'),
+]
+
+# Runs after every other handler group, marking the update as fully processed
+DONE_GROUP = 10_000
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Bot API transport that answers locally after a fixed delay"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = defaultdict(int)
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            result = {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class FakeSheetsClient:
+    """Stand-in for SheetsClient; appends sleep like real Sheets requests"""
+
+    available = True
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.rows = 0
+        self.calls = 0
+
+    def ensure_headers(self, name, headers, index=0):
+        pass
+
+    async def append_rows(self, name, rows, headers, index=0):
+        await asyncio.sleep(self.latency)
+        self.calls += 1
+        self.rows += len(rows)
+
+
+def fake_rate_fetcher(latency):
+    async def fetch():
+        await asyncio.sleep(latency)
+        return RateTable('IDR', {'IDR': 1, 'TRY': 0.00234, 'USD': 0.0000615, 'EUR': 0.0000566})
+    return fetch
+
+
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+    def build(self, user_id, kind, payload):
+        update_id = next(self._ids)
+        chat = {'id': user_id, 'type': 'private'}
+        if kind == 'message':
+            message = {
+                'message_id': update_id, 'date': int(time.time()), 'chat': chat,
+                'from': self._user(user_id), 'text': payload,
+            }
+            if payload.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(payload)}]
+            data = {'update_id': update_id, 'message': message}
+        else:
+            data = {'update_id': update_id, 'callback_query': {
+                'id': str(update_id), 'chat_instance': str(user_id), 'data': payload,
+                'from': self._user(user_id),
+                'message': {'message_id': 1, 'date': int(time.time()), 'chat': chat,
+                            'from': BOT_USER, 'text': '...'},
+            }}
+        return Update.de_json(data, self.bot)
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.transport = FakeTelegramRequest(args.telegram_latency)
+        self.sheets = FakeSheetsClient(args.sheets_latency)
+        self.latencies = defaultdict(list)
+        self._pending = {}
+
+    def install_stand_ins(self):
+        main.rate_service._fetch = fake_rate_fetcher(self.args.rate_latency)
+        main.rate_service.sync_quota = lambda: asyncio.sleep(0)
+        main.sheets_client = self.sheets
+        main.sheet_queue.client = self.sheets
+
+    async def _mark_done(self, update, context):
+        future = self._pending.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def _send(self, application, factory, user_id, step, kind, payload):
+        update = factory.build(user_id, kind, payload)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[update.update_id] = future
+        start = time.perf_counter()
+        await application.update_queue.put(update)
+        finished = await asyncio.wait_for(future, self.args.step_timeout)
+        self.latencies[step].append(finished - start)
+
+    async def _conversation(self, application, factory, user_id, flow):
+        for step, kind, payload in flow:
+            await self._send(application, factory, user_id, step, kind, payload)
+            if self.args.think_time:
+                await asyncio.sleep(self.args.think_time)
+
+    async def run(self):
+        self.install_stand_ins()
+        application = main.build_application(request=self.transport)
+        application.add_handler(TypeHandler(Update, self._mark_done), group=DONE_GROUP)
+
+        await application.initialize()
+        await main.post_init(application)
+        await application.start()
+
+        factory = UpdateFactory(application.bot)
+        flows = {'buy': BUY_FLOW, 'sell': SELL_FLOW}
+        chosen = [flows[name] for name in self.args.flows.split(',')]
+
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(
+                self._conversation(application, factory, 1000 + i, chosen[i % len(chosen)])
+                for i in range(self.args.users)
+            ))
+        finally:
+            elapsed = time.perf_counter() - start
+            await application.stop()
+            await main.post_stop(application)
+            await application.shutdown()
+            await main.post_shutdown(application)
+
+        self.report(elapsed)
+
+    def report(self, elapsed):
+        total = sum(len(v) for v in self.latencies.values())
+        print(f"\nUsers: {self.args.users}  flows: {self.args.flows}  "
+              f"latency (telegram/rates/sheets): {self.args.telegram_latency}/"
+              f"{self.args.rate_latency}/{self.args.sheets_latency}s")
+        print(f"Updates processed: {total} in {elapsed:.2f}s -> {total / elapsed:.1f} updates/s, "
+              f"{self.args.users / elapsed:.1f} conversations/s")
+        print(f"\n{'step':<16}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for step, values in self.latencies.items():
+            values = sorted(values)
+            p50 = values[len(values) // 2]
+            p99 = values[min(int(len(values) * 0.99), len(values) - 1)]
+            print(f"{step:<16}{len(values):>8}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}{values[-1] * 1000:>10.1f}")
+        print(f"\nBot API calls: {dict(self.transport.calls)}")
+        print(f"Sheets rows written: {self.sheets.rows} in {self.sheets.calls} calls")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for LiraKuBot conversations")
+    parser.add_argument('--users', type=int, default=100, help="concurrent conversations")
+    parser.add_argument('--flows', default='buy,sell', help="comma separated: buy, sell")
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help="seconds per Bot API call")
+    parser.add_argument('--rate-latency', type=float, default=0.3, help="seconds per exchangerate-api call")
+    parser.add_argument('--sheets-latency', type=float, default=0.5, help="seconds per Sheets call")
+    parser.add_argument('--think-time', type=float, default=0.0, help="pause between a user's steps")
+    parser.add_argument('--step-timeout', type=float, default=120.0)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    with _workdir:
+        asyncio.run(LoadTest(parse_args()).run())
@@ -1,41 +1,56 @@
+import time
+BOOT_STARTED = time.perf_counter()  # before any other import, for the startup timings
+
 import os
 import logging
 import asyncio
-import requests
+import importlib.util
 import threading
 import json
+import secrets
+import signal
+from collections import namedtuple
 from datetime import datetime
-from decimal import Decimal, ROUND_DOWN
+from decimal import InvalidOperation
 from dotenv import load_dotenv
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
-# Flask imports for keep alive
-try:
-    from flask import Flask
-    FLASK_AVAILABLE = True
-except ImportError:
+# Flask is only needed for the Replit keep-alive server and is imported there
+FLASK_AVAILABLE = importlib.util.find_spec('flask') is not None
+if not FLASK_AVAILABLE:
     print("⚠️ Flask not found. Install with: pip install flask")
-    FLASK_AVAILABLE = False
 
 try:
-    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram import Bot, Update, InlineQueryResultsButton
     from telegram.ext import (
-        Application, CommandHandler, CallbackQueryHandler, 
+        Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler,
         MessageHandler, filters, ContextTypes, ConversationHandler
     )
 except ImportError as e:
     print(f"❌ Error importing telegram libraries: {e}")
-    print("💡 Coba install ulang dengan: pip install --upgrade python-telegram-bot==20.3")
+    print("💡 Coba install ulang dengan: pip install --upgrade python-telegram-bot==20.8")
     exit(1)
 
-# Import Google Sheets dependencies
-try:
-    import gspread
-    from google.oauth2.service_account import Credentials
-except ImportError:
-    print("⚠️ Google Sheets dependencies not found. Install with: pip install gspread google-auth")
-    gspread = None
-    Credentials = None
+from rates import RateService, RateRefresher, RateStore, SnapshotCache
+from sheets import SheetsClient, SheetWriteQueue
+from journal import TransactionJournal
+from persistence import SQLitePersistence
+from webserver import WebServer, Response, json_response, text_response
+import metrics
+from profiling import SlowHandlerProfiler
+from concurrency import PerChatUpdateProcessor
+from ratelimit import PriorityRateLimiter
+from notifications import AdminNotifier
+from cluster import HANDOFF_HEADER, ClusterFrontend, WorkerSupervisor
+from httpclient import HttpClient
+from exchange import Pricing, parse_idr, parse_try
+from inline import InlineQuoteTable
+from rendering import (
+    code_text, format_currency, format_idr, markdown_text, MAIN_KEYBOARD, BACK_MENU_KEYBOARD,
+    CONFIRMATION_KEYBOARD, PAYMENT_KEYBOARD, SELL_SENT_KEYBOARD
+)
+
+IMPORT_SECONDS = time.perf_counter() - BOOT_STARTED
 
 # Load environment variables
 load_dotenv()
@@ -52,6 +67,47 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 EXCHANGE_API_KEY = os.getenv('EXCHANGE_API_KEY')
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')
 ADMIN_IBAN = os.getenv('ADMIN_IBAN', 'TR1234567890123456789012345')
+RATE_CACHE_TTL = int(os.getenv('RATE_CACHE_TTL', 1800))  # seconds
+# Rates older than this are not quoted from, even while exchangerate-api is down
+RATE_MAX_AGE = int(os.getenv('RATE_MAX_AGE', 24 * 3600))  # seconds
+# Orders within this many seconds of the last admin notification are sent as one digest
+ADMIN_DIGEST_WINDOW = float(os.getenv('ADMIN_DIGEST_WINDOW', 10))
+# How long Telegram may reuse an inline answer for the same query
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 60))  # seconds
+
+# Webhook mode (enabled when WEBHOOK_URL is set, e.g. https://lirakubot.koyeb.app)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = '/telegram'
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+# Cluster mode (webhook only): the process started by the user becomes a front-end
+# that routes updates by user to CLUSTER_WORKERS local worker processes (ports
+# WORKER_BASE_PORT, +1, ...) plus any worker URLs in CLUSTER_NODES. The front-end
+# sets CLUSTER_ROLE/CLUSTER_SLOT for the workers it starts; workers on other nodes
+# are started with CLUSTER_ROLE=worker and their own CLUSTER_SLOT by hand.
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', 0))
+CLUSTER_NODES = [url.strip().rstrip('/') for url in os.getenv('CLUSTER_NODES', '').split(',') if url.strip()]
+CLUSTER_ROLE = os.getenv('CLUSTER_ROLE', '')
+# Required for workers (-1 means unset); a single process is slot 0
+CLUSTER_SLOT = int(os.getenv('CLUSTER_SLOT', -1 if CLUSTER_ROLE == 'worker' else 0))
+WORKER_HOST = os.getenv('WORKER_HOST', '127.0.0.1')
+WORKER_BASE_PORT = int(os.getenv('WORKER_BASE_PORT', int(os.getenv('PORT', 8080)) + 1))
+# Slot 0 refreshes rates for every process sharing its database
+CLUSTER_LEADER = CLUSTER_SLOT == 0
+
+# Updates handled at once across all chats; updates of one chat always run in order
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', 64))
+
+# Outbound HTTP (exchange rates, Sheets appends): read timeout and concurrent requests per host
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 10))
+HTTP_MAX_PER_HOST = int(os.getenv('HTTP_MAX_PER_HOST', 10))
+
+# Longest the startup warm-up may delay accepting updates; unfinished steps continue in the background
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', 15))
+
+# Slow handler profiling: 'stack', 'cprofile' or 'off'
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'stack')
+SLOW_HANDLER_BUDGET_MS = int(os.getenv('SLOW_HANDLER_BUDGET_MS', 500))
 
 # Feature toggles
 BUY_LIRA_ACTIVE = True
@@ -59,6 +115,8 @@ SELL_LIRA_ACTIVE = True
 
 # Fee configuration
 ADMIN_FEE = 5000  # 5,000 IDR admin fee
+MARGIN = '0.025'  # 2.5% margin on every conversion (hidden from user)
+MIN_BUY_AMOUNT = 100000  # Rp100.000 minimum purchase
 
 # Conversation states
 (WAITING_BUY_AMOUNT, WAITING_BUY_NAME, WAITING_BUY_IBAN, WAITING_BUY_CONFIRMATION,
@@ -68,9 +126,31 @@ ADMIN_FEE = 5000  # 5,000 IDR admin fee
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 SERVICE_ACCOUNT_FILE = 'lirakubot.json'
 SPREADSHEET_NAME = 'DATA LIRAKU.ID'
-
-# Flask app for keep alive
-if FLASK_AVAILABLE:
+JOURNAL_PATH = os.getenv('JOURNAL_PATH', 'lirakubot.db')
+PERSISTENCE_PATH = os.getenv('PERSISTENCE_PATH', 'lirakubot.db')
+RATE_STORE_PATH = os.getenv('RATE_STORE_PATH', 'lirakubot.db')
+# Seconds between persistence writes; short for cluster workers so a restarted worker loses little
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', 1 if CLUSTER_ROLE == 'worker' else 5))
+STATUS_PENDING = 'Menunggu Konfirmasi'
+STATUS_DONE = 'Selesai'
+SHEET_HEADERS = ['Waktu', 'Nama', 'IBAN/Rekening', 'IDR', 'TRY', 'Status', 'Username', 'User ID', 'Jenis']
+
+def health_status():
+    """Health payload shared by the Flask and webhook servers"""
+    return {
+        "status": "healthy",
+        "bot": "LiraKuBot",
+        "timestamp": datetime.now().isoformat(),
+        "uptime": "running",
+        "rate_quota": rate_service.quota.as_dict(),
+        "rate_circuit": rate_service.breaker.state,
+        "rate_age_seconds": round(rate_service.age) if rate_service.table else None,
+        "startup_seconds": {phase: round(seconds, 3) for phase, seconds in startup_timings.items()}
+    }
+
+def create_flask_app():
+    """Flask app for keep alive"""
+    from flask import Flask
     app = Flask(__name__)
     
     @app.route('/')
@@ -79,415 +159,429 @@ if FLASK_AVAILABLE:
     
     @app.route('/health')
     def health():
-        return {
-            "status": "healthy",
-            "bot": "LiraKuBot",
-            "timestamp": datetime.now().isoformat(),
-            "uptime": "running"
-        }
-    
-    def keep_alive():
-        """Start Flask server in a separate thread for Replit keep-alive"""
-        def run():
-            # Use different port for Replit
-            port = int(os.getenv('PORT', 8080))
-            try:
-                app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
-            except Exception as e:
-                logger.error(f"Flask server error: {e}")
-        
-        # Start Flask in daemon thread
-        server_thread = threading.Thread(target=run, daemon=True)
-        server_thread.start()
-        logger.info(f"🌐 Flask keep-alive server started on port {os.getenv('PORT', 8080)}")
-        print(f"🌐 Flask keep-alive server started - LiraKuBot is alive!")
-        
-        return server_thread
-else:
-    def keep_alive():
+        return health_status()
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return metrics.REGISTRY.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+    return app
+
+def keep_alive():
+    """Start Flask server in a separate thread for Replit keep-alive"""
+    if not FLASK_AVAILABLE:
         logger.warning("Flask not available, keep-alive server not started")
         print("⚠️ Flask not available, keep-alive server not started")
         return None
 
-def get_google_sheets_client():
-    """Initialize Google Sheets client"""
-    try:
-        if not gspread or not Credentials:
-            logger.warning("Google Sheets dependencies not available")
-            return None
+    def run():
+        # Use different port for Replit
+        port = int(os.getenv('PORT', 8080))
+        try:
+            # Imported here, off the startup path
+            create_flask_app().run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
+        except Exception as e:
+            logger.error(f"Flask server error: {e}")
+    
+    # Start Flask in daemon thread
+    server_thread = threading.Thread(target=run, daemon=True)
+    server_thread.start()
+    logger.info(f"🌐 Flask keep-alive server started on port {os.getenv('PORT', 8080)}")
+    print(f"🌐 Flask keep-alive server started - LiraKuBot is alive!")
+    
+    return server_thread
 
-        creds = Credentials.from_service_account_file(
-            SERVICE_ACCOUNT_FILE, scopes=SCOPES
-        )
-        return gspread.authorize(creds)
-    except Exception as e:
-        logger.error(f"Error initializing Google Sheets: {e}")
-        return None
+# Pooled HTTP client shared by the exchange rate API and Google Sheets appends
+http_client = HttpClient(timeout=HTTP_TIMEOUT, max_per_host=HTTP_MAX_PER_HOST)
 
-def get_exchange_rate(from_currency='IDR', to_currency='TRY'):
-    """Get exchange rate from exchangerate-api"""
-    try:
-        url = f"https://v6.exchangerate-api.com/v6/{EXCHANGE_API_KEY}/pair/{from_currency}/{to_currency}"
-        response = requests.get(url, timeout=10)
-        data = response.json()
-
-        if data['result'] == 'success':
-            return float(data['conversion_rate'])
-        else:
-            logger.error(f"Exchange rate API error: {data}")
-            return None
-    except Exception as e:
-        logger.error(f"Error fetching exchange rate: {e}")
-        return None
+# Shared Google Sheets connection (authorized once, handles cached)
+sheets_client = SheetsClient(SERVICE_ACCOUNT_FILE, SCOPES, http=http_client)
 
-def save_to_sheets(transaction_data):
-    """Save transaction to Google Sheets"""
-    try:
-        gc = get_google_sheets_client()
-        if not gc:
-            logger.warning("Google Sheets not available, skipping save")
-            return True  # Return True to not block the process
+# Shared exchange rate cache (one instance for all handlers), saved for other processes
+rate_service = RateService(
+    EXCHANGE_API_KEY, ttl=RATE_CACHE_TTL, store=RateStore(RATE_STORE_PATH), max_age=RATE_MAX_AGE,
+    http=http_client
+)
 
-        sheet = gc.open(SPREADSHEET_NAME).sheet1
+# Margin and admin fee applied to every quote
+pricing = Pricing(margin=MARGIN, admin_fee=ADMIN_FEE)
+# Fixed parts of the confirmation and admin messages, formatted once
+ADMIN_FEE_TEXT = format_idr(ADMIN_FEE)
+MARGIN_PERCENT = (pricing.margin * 100).normalize()
 
-        # Add headers if sheet is empty
-        if not sheet.get_all_records():
-            headers = ['Waktu', 'Nama', 'IBAN/Rekening', 'IDR', 'TRY', 'Status', 'Username', 'User ID', 'Jenis']
-            sheet.append_row(headers)
+async def get_prices():
+    """Price snapshot for the current rates, or None if rates are unavailable"""
+    return pricing.prices(await rate_service.get_table())
 
-        sheet.append_row(transaction_data)
-        return True
-    except Exception as e:
-        logger.error(f"Error saving to sheets: {e}")
+# Local durable journal; every transaction is fsynced here first
+journal = TransactionJournal(JOURNAL_PATH, owner=CLUSTER_SLOT)
+
+# Transactions are written behind the user's back in batches
+sheet_queue = SheetWriteQueue(sheets_client, SPREADSHEET_NAME, SHEET_HEADERS, on_written=journal.mark_synced)
+
+# Admin order notifications, coalesced into digests during bursts
+admin_notifier = AdminNotifier(ADMIN_CHAT_ID, window=ADMIN_DIGEST_WINDOW)
+
+def save_to_sheets(transaction_data, entry_id=None):
+    """Queue transaction for Google Sheets (written in the background)"""
+    if not sheets_client.available:
+        logger.warning("Google Sheets not available, skipping save")
         return True  # Return True to not block the process
 
-def save_transaction(transaction_data):
-    """Save transaction - wrapper function"""
-    return save_to_sheets(transaction_data)
-
-def get_main_keyboard():
-    """Create main menu keyboard"""
-    keyboard = [
-        [InlineKeyboardButton("💸 Beli Lira", callback_data="buy_lira")],
-        [InlineKeyboardButton("💵 Jual Lira", callback_data="sell_lira")],
-        [InlineKeyboardButton("💱 Lihat Simulasi Kurs", callback_data="simulation")],
-        [InlineKeyboardButton("👤 Kontak Admin", callback_data="contact_admin")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    sheet_queue.put(transaction_data, entry_id)
+    return True
 
-def get_back_menu_keyboard():
-    """Create back and menu keyboard"""
-    keyboard = [
-        [InlineKeyboardButton("🔙 Kembali", callback_data="back")],
-        [InlineKeyboardButton("🏠 Menu Utama", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def get_confirmation_keyboard():
-    """Create confirmation keyboard"""
-    keyboard = [
-        [InlineKeyboardButton("✅ Data Sudah Benar", callback_data="confirm_transaction")],
-        [InlineKeyboardButton("🔙 Kembali", callback_data="back")],
-        [InlineKeyboardButton("🏠 Menu Utama", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def get_payment_keyboard():
-    """Create payment confirmation keyboard"""
-    keyboard = [
-        [InlineKeyboardButton("✅ Saya sudah bayar", callback_data="payment_sent")],
-        [InlineKeyboardButton("🔙 Kembali", callback_data="back")],
-        [InlineKeyboardButton("🏠 Menu Utama", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+async def save_transaction(transaction_data):
+    """Save transaction - journal it locally, then queue it for Sheets
 
-def format_currency(amount, currency='IDR'):
-    """Format currency display"""
-    if currency == 'IDR':
-        return f"Rp{amount:,.0f}".replace(',', '.')
-    elif currency == 'TRY':
-        return f"₺{amount:,.2f}".replace(',', '.')
-    return f"{amount:,.2f}"
+    A journal failure does not lose the order: it still goes to Sheets, only
+    without the journal's retry across restarts. False only if neither
+    could take it.
+    """
+    try:
+        entry_id = await asyncio.to_thread(journal.append, transaction_data)
+    except Exception as e:
+        logger.error(f"Error writing transaction journal, saving to Sheets only: {e}")
+        if not sheets_client.available:
+            return False
+        entry_id = None
+
+    return save_to_sheets(transaction_data, entry_id)
+
+async def replay_journal():
+    """Queue journaled transactions that never reached Google Sheets"""
+    if not sheets_client.available:
+        return
+    pending = await asyncio.to_thread(journal.unsynced)
+    for entry_id, row in pending:
+        sheet_queue.put(row, entry_id)
+    if pending:
+        logger.info(f"Replaying {len(pending)} unsynced transactions to Google Sheets")
+
+async def warm_rates():
+    """Rates, prices, the simulation text and inline quotes of the current snapshot"""
+    # Quote from the last good rates right away; a stale table is revalidated in the background
+    if await rate_service.load_stored():
+        logger.info(f"Loaded stored exchange rates, {rate_service.age:.0f}s old")
+    await get_prices()
+    await simulation_cache.get()
+    await inline_quotes.get()
+
+async def warm_sheets():
+    """Import the Sheets libraries, authorize and open the worksheet"""
+    if sheets_client.available:
+        await asyncio.to_thread(sheets_client.ensure_headers, SPREADSHEET_NAME, SHEET_HEADERS)
+
+# Seconds per startup phase, also exported as lirakubot_startup_seconds
+startup_timings = {}
+
+def record_startup(phase, seconds):
+    startup_timings[phase] = seconds
+    metrics.STARTUP_SECONDS.set(seconds, phase=phase)
+
+async def timed(phase, coroutine):
+    start = time.perf_counter()
+    try:
+        await coroutine
+    except Exception as e:
+        logger.warning(f"Startup step {phase} failed: {e}")
+    finally:
+        record_startup(phase, time.perf_counter() - start)
+
+async def warm_up():
+    """Warm the critical path concurrently, so the first user doesn't pay for it"""
+    start = time.perf_counter()
+    # Each process replays only the rows it journaled itself (see TransactionJournal)
+    steps = {'warmup_rates': warm_rates(), 'warmup_sheets': warm_sheets(), 'replay_journal': replay_journal()}
+    tasks = [asyncio.create_task(timed(phase, step)) for phase, step in steps.items()]
+    _, pending = await asyncio.wait(tasks, timeout=WARMUP_TIMEOUT)
+    if pending:
+        logger.warning(f"Warm-up not finished after {WARMUP_TIMEOUT:.0f}s, accepting updates anyway")
+    record_startup('warmup', time.perf_counter() - start)
+
+async def post_init(application: Application):
+    """Start background workers and warm up once the event loop is running"""
+    sheet_queue.start()
+    admin_notifier.start(application.bot)
+    record_startup('imports', IMPORT_SECONDS)
+    await warm_up()
+
+    record_startup('ready', time.perf_counter() - BOOT_STARTED)
+    logger.info("Startup: " + ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in startup_timings.items()))
+
+async def post_stop(application: Application):
+    """Send held admin notifications while the bot can still reach Telegram"""
+    await admin_notifier.stop()
+
+async def post_shutdown(application: Application):
+    """Flush pending sheet rows before the process exits"""
+    rate_service.close()
+    await sheet_queue.stop()
+    await http_client.aclose()
+
+WELCOME_MESSAGE = (
+    "💚 **Selamat datang di LiraKuBot!**\n\n"
+    "✅ Proses cepat & aman\n"
+    "✅ Langsung kirim ke IBAN\n"
+    "✅ Lebih hemat dibanding beli di bandara & bank\n\n"
+    "Silakan pilih menu:"
+)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start command handler"""
-    welcome_message = (
-        "💚 **Selamat datang di LiraKuBot!**\n\n"
-        "✅ Proses cepat & aman\n"
-        "✅ Langsung kirim ke IBAN\n"
-        "✅ Lebih hemat dibanding beli di bandara & bank\n\n"
-        "Silakan pilih menu:"
-    )
-
     await update.message.reply_text(
-        welcome_message,
-        reply_markup=get_main_keyboard(),
+        WELCOME_MESSAGE,
+        reply_markup=MAIN_KEYBOARD,
         parse_mode='Markdown'
     )
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle button callbacks"""
-    query = update.callback_query
-    await query.answer()
+# Prompts shown when a conversation step asks for its input
+BUY_AMOUNT_PROMPT = (
+    "💸 **Beli Lira (IDR ke TRY)**\n\n"
+    "Masukkan nominal dalam Rupiah yang ingin dikonversi ke Lira Turki.\n"
+    "Minimal pembelian: Rp100.000\n\n"
+    "Contoh: 500000"
+)
 
-    if query.data == "main_menu":
-        welcome_message = (
-            "💚 **Selamat datang di LiraKuBot!**\n\n"
-            "✅ Proses cepat & aman\n"
-            "✅ Langsung kirim ke IBAN\n"
-            "✅ Lebih hemat dibanding beli di bandara & bank\n\n"
-            "Silakan pilih menu:"
-        )
-        await query.edit_message_text(
-            welcome_message,
-            reply_markup=get_main_keyboard(),
-            parse_mode='Markdown'
-        )
-        return ConversationHandler.END
+def buy_name_prompt(amount, try_amount):
+    return (
+        "💰 **Estimasi Konversi**\n\n"
+        f"💸 Nominal: {format_idr(amount)}\n"
+        f"🇹🇷 Estimasi TRY: ₺{try_amount:.2f}\n\n"
+        "Masukkan nama lengkap sesuai IBAN Anda:"
+    )
 
-    elif query.data == "buy_lira":
-        if not BUY_LIRA_ACTIVE:
-            await query.edit_message_text(
-                "❌ Maaf, pembelian Lira sedang tidak tersedia.",
-                reply_markup=get_back_menu_keyboard()
-            )
-            return ConversationHandler.END
+def buy_iban_prompt(name):
+    return (
+        f"👤 Nama: **{markdown_text(name)}**\n\n"
+        "Masukkan IBAN Turki Anda (format: TR + 24 angka)\n"
+        "Contoh: `TR123456789012345678901234`"
+    )
 
-        await query.edit_message_text(
-            "💸 **Beli Lira (IDR ke TRY)**\n\n"
-            "Masukkan nominal dalam Rupiah yang ingin dikonversi ke Lira Turki.\n"
-            "Minimal pembelian: Rp100.000\n\n"
-            "Contoh: 500000",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        return WAITING_BUY_AMOUNT
+SELL_AMOUNT_PROMPT = (
+    "💵 **Jual Lira (TRY ke IDR)**\n\n"
+    "Masukkan jumlah Lira Turki yang ingin dijual.\n\n"
+    "Contoh: 100"
+)
 
-    elif query.data == "sell_lira":
-        if not SELL_LIRA_ACTIVE:
-            await query.edit_message_text(
-                "❌ Maaf, penjualan Lira sedang tidak tersedia.",
-                reply_markup=get_back_menu_keyboard()
-            )
-            return ConversationHandler.END
+def sell_name_prompt(amount, idr_gross):
+    return (
+        "💰 **Estimasi Konversi**\n\n"
+        f"🇹🇷 Lira: ₺{amount:,.2f}\n"
+        f"💵 Estimasi IDR: {format_idr(idr_gross)}\n\n"
+        "Masukkan nama lengkap Anda:"
+    )
 
-        await query.edit_message_text(
-            "💵 **Jual Lira (TRY ke IDR)**\n\n"
-            "Masukkan jumlah Lira Turki yang ingin dijual.\n\n"
-            "Contoh: 100",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        return WAITING_SELL_AMOUNT
+def sell_account_prompt(name):
+    return (
+        f"👤 Nama: **{markdown_text(name)}**\n\n"
+        "Masukkan nomor rekening bank Indonesia Anda.\n"
+        "Format: [Nama Bank] - [Nomor Rekening]\n"
+        "Contoh: `BCA - 1234567890`"
+    )
+
+# One conversation step: its ConversationHandler state, the prompt asking for
+# its input (text, or a function of user_data), the keyboard shown with the
+# prompt and the step "back" returns to (None: stay on this step)
+Step = namedtuple('Step', 'state prompt keyboard back')
+
+STEPS = {
+    'buy_amount': Step(WAITING_BUY_AMOUNT, BUY_AMOUNT_PROMPT, BACK_MENU_KEYBOARD, None),
+    'buy_name': Step(WAITING_BUY_NAME, lambda data: buy_name_prompt(
+        amount=data.get('buy_amount_idr', 0), try_amount=data.get('buy_estimated_try', 0)
+    ), BACK_MENU_KEYBOARD, 'buy_amount'),
+    'buy_iban': Step(WAITING_BUY_IBAN, lambda data: buy_iban_prompt(
+        name=data.get('buy_name', '')
+    ), BACK_MENU_KEYBOARD, 'buy_name'),
+    'buy_confirmation': Step(WAITING_BUY_CONFIRMATION, None, None, 'buy_iban'),
+    'sell_amount': Step(WAITING_SELL_AMOUNT, SELL_AMOUNT_PROMPT, BACK_MENU_KEYBOARD, None),
+    'sell_name': Step(WAITING_SELL_NAME, lambda data: sell_name_prompt(
+        amount=data.get('sell_amount_try', 0), idr_gross=data.get('sell_estimated_idr_gross', 0)
+    ), BACK_MENU_KEYBOARD, 'sell_amount'),
+    'sell_account': Step(WAITING_SELL_ACCOUNT, lambda data: sell_account_prompt(
+        name=data.get('sell_name', '')
+    ), BACK_MENU_KEYBOARD, 'sell_name'),
+    'sell_confirmation': Step(WAITING_SELL_CONFIRMATION, None, None, 'sell_account'),
+}
+
+def step_prompt(step, user_data):
+    """Prompt text of a conversation step"""
+    prompt = STEPS[step].prompt
+    return prompt(user_data) if callable(prompt) else prompt
+
+async def enter_step(message_func, step, context):
+    """Show a step's prompt via ``message_func`` and return its conversation state"""
+    context.user_data['current_state'] = step
+    await message_func(
+        step_prompt(step, context.user_data),
+        reply_markup=STEPS[step].keyboard,
+        parse_mode='Markdown'
+    )
+    return STEPS[step].state
 
-    elif query.data == "simulation":
-        await show_simulation(query)
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Replace the message with the main menu and leave any conversation"""
+    await update.callback_query.edit_message_text(
+        WELCOME_MESSAGE,
+        reply_markup=MAIN_KEYBOARD,
+        parse_mode='Markdown'
+    )
+    return ConversationHandler.END
 
-    elif query.data == "contact_admin":
-        contact_message = (
-            "👤 **Kontak Admin**\n\n"
-            "📱 Telegram: @lirakuid\n"
-            "📞 WhatsApp: 087773834406"
+async def start_buy(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start the buy conversation"""
+    query = update.callback_query
+    if not BUY_LIRA_ACTIVE:
+        await query.edit_message_text(
+            "❌ Maaf, pembelian Lira sedang tidak tersedia.",
+            reply_markup=BACK_MENU_KEYBOARD
         )
+        return ConversationHandler.END
+    return await enter_step(query.edit_message_text, 'buy_amount', context)
+
+async def start_sell(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start the sell conversation"""
+    query = update.callback_query
+    if not SELL_LIRA_ACTIVE:
         await query.edit_message_text(
-            contact_message,
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
+            "❌ Maaf, penjualan Lira sedang tidak tersedia.",
+            reply_markup=BACK_MENU_KEYBOARD
         )
+        return ConversationHandler.END
+    return await enter_step(query.edit_message_text, 'sell_amount', context)
+
+async def show_contact_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show admin contact details"""
+    contact_message = (
+        "👤 **Kontak Admin**\n\n"
+        "📱 Telegram: @lirakuid\n"
+        "📞 WhatsApp: 087773834406"
+    )
+    await update.callback_query.edit_message_text(
+        contact_message,
+        reply_markup=BACK_MENU_KEYBOARD,
+        parse_mode='Markdown'
+    )
 
-    elif query.data == "confirm_transaction":
-        await handle_transaction_confirmation(update, context)
+async def handle_back_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Return to the previous conversation step, or to the main menu outside a conversation"""
+    step = STEPS.get(context.user_data.get('current_state'))
+    if step is None:
+        return await show_main_menu(update, context)
+    target = step.back or context.user_data['current_state']
+    return await enter_step(update.callback_query.edit_message_text, target, context)
 
-    elif query.data == "payment_sent":
-        await handle_payment_confirmation(update, context)
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle button callbacks with one CALLBACK_ROUTES lookup
 
-    elif query.data == "sell_sent":
-        await handle_sell_confirmation(update, context)
+    Returns the route's conversation state, so the same callback works as a
+    conversation entry point, inside any conversation state and outside.
+    """
+    query = update.callback_query
+    await query.answer()
 
-    elif query.data == "back":
-        await handle_back_navigation(update, context)
+    route = CALLBACK_ROUTES.get(query.data)
+    if route is None:
+        return None
+    return await route(update, context)
 
-async def handle_back_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle back navigation"""
-    query = update.callback_query
-    current_state = context.user_data.get('current_state', None)
+def render_simulation(table):
+    """Simulation message and keyboard for one rate snapshot"""
+    prices = pricing.prices(table)
+    if prices is None:
+        return None
 
-    if current_state == 'buy_amount':
-        await query.edit_message_text(
-            "💸 **Beli Lira (IDR ke TRY)**\n\n"
-            "Masukkan nominal dalam Rupiah yang ingin dikonversi ke Lira Turki.\n"
-            "Minimal pembelian: Rp100.000\n\n"
-            "Contoh: 500000",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        return WAITING_BUY_AMOUNT
-    elif current_state == 'buy_name':
-        await query.edit_message_text(
-            "💸 **Beli Lira (IDR ke TRY)**\n\n"
-            "Masukkan nominal dalam Rupiah yang ingin dikonversi ke Lira Turki.\n"
-            "Minimal pembelian: Rp100.000\n\n"
-            "Contoh: 500000",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        context.user_data['current_state'] = 'buy_amount'
-        return WAITING_BUY_AMOUNT
-    elif current_state == 'buy_iban':
-        await query.edit_message_text(
-            f"💰 **Estimasi Konversi**\n\n"
-            f"💸 Nominal: {format_currency(context.user_data.get('buy_amount_idr', 0))}\n"
-            f"🇹🇷 Estimasi TRY: ₺{context.user_data.get('buy_estimated_try', 0):.2f}\n\n"
-            f"Masukkan nama lengkap sesuai IBAN Anda:",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        context.user_data['current_state'] = 'buy_name'
-        return WAITING_BUY_NAME
-    elif current_state == 'buy_confirmation':
-        await query.edit_message_text(
-            f"👤 Nama: **{context.user_data.get('buy_name', '')}**\n\n"
-            f"Masukkan IBAN Turki Anda (format: TR + 24 angka)\n"
-            f"Contoh: `TR123456789012345678901234`",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        context.user_data['current_state'] = 'buy_iban'
-        return WAITING_BUY_IBAN
-    elif current_state == 'sell_amount':
-        await query.edit_message_text(
-            "💵 **Jual Lira (TRY ke IDR)**\n\n"
-            "Masukkan jumlah Lira Turki yang ingin dijual.\n\n"
-            "Contoh: 100",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        return WAITING_SELL_AMOUNT
-    elif current_state == 'sell_name':
-        await query.edit_message_text(
-            "💵 **Jual Lira (TRY ke IDR)**\n\n"
-            "Masukkan jumlah Lira Turki yang ingin dijual.\n\n"
-            "Contoh: 100",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        context.user_data['current_state'] = 'sell_amount'
-        return WAITING_SELL_AMOUNT
-    elif current_state == 'sell_account':
-        await query.edit_message_text(
-            f"💰 **Estimasi Konversi**\n\n"
-            f"🇹🇷 Lira: ₺{context.user_data.get('sell_amount_try', 0):,.2f}\n"
-            f"💵 Estimasi IDR: {format_currency(context.user_data.get('sell_estimated_idr_gross', 0))}\n\n"
-            f"Masukkan nama lengkap Anda:",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        context.user_data['current_state'] = 'sell_name'
-        return WAITING_SELL_NAME
-    elif current_state == 'sell_confirmation':
-        await query.edit_message_text(
-            f"👤 Nama: **{context.user_data.get('sell_name', '')}**\n\n"
-            "Masukkan nomor rekening bank Indonesia Anda.\n"
-            "Format: [Nama Bank] - [Nomor Rekening]\n"
-            "Contoh: `BCA - 1234567890`",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        context.user_data['current_state'] = 'sell_account'
-        return WAITING_SELL_ACCOUNT
-    else:
-        # Default back to main menu
-        welcome_message = (
-            "💚 **Selamat datang di LiraKuBot!**\n\n"
-            "✅ Proses cepat & aman\n"
-            "✅ Langsung kirim ke IBAN\n"
-            "✅ Lebih hemat dibanding beli di bandara & bank\n\n"
-            "Silakan pilih menu:"
-        )
-        await query.edit_message_text(
-            welcome_message,
-            reply_markup=get_main_keyboard(),
-            parse_mode='Markdown'
-        )
-        return ConversationHandler.END
+    # Margin is already part of the quotes (hidden from user)
+    buy_100k, buy_500k, buy_1m = prices.quote_many((100000, 500000, 1000000), 'buy')
+    sell_100, sell_500, sell_1000 = prices.quote_many((100, 500, 1000), 'sell')
+    simulation_message = (
+        "💱 **Simulasi Tukar IDR ke TRY**\n"
+        f"💸 Rp100.000 → 🇹🇷 ₺{buy_100k.try_amount:.2f}\n"
+        f"💸 Rp500.000 → 🇹🇷 ₺{buy_500k.try_amount:.2f}\n"
+        f"💸 Rp1.000.000 → 🇹🇷 ₺{buy_1m.try_amount:.2f}\n\n"
+        "💱 **Simulasi Tukar TRY ke IDR**\n"
+        f"🇹🇷 ₺100 → {format_currency(sell_100.idr_gross)}\n"
+        f"🇹🇷 ₺500 → {format_currency(sell_500.idr_gross)}\n"
+        f"🇹🇷 ₺1.000 → {format_currency(sell_1000.idr_gross)}\n\n"
+        f"*Simulasi di atas belum termasuk biaya admin*\n"
+        f"*Update: {datetime.fromtimestamp(table.fetched_at).strftime('%H:%M %d/%m/%Y')}*"
+    )
+    return simulation_message, BACK_MENU_KEYBOARD
+
+# Rendered once per rate snapshot; a refresh brings a new snapshot and a new render
+simulation_cache = SnapshotCache(rate_service, render_simulation)
+
+def build_inline_quotes(table):
+    """Inline quote table for one rate snapshot"""
+    prices = pricing.prices(table)
+    return None if prices is None else InlineQuoteTable(prices, MIN_BUY_AMOUNT)
+
+# Inline answers come from the current snapshot only, so a keystroke never waits on the rate API
+inline_quotes = SnapshotCache(rate_service, build_inline_quotes)
+INLINE_BUTTON = InlineQueryResultsButton("💚 Transaksi di LiraKuBot", start_parameter="inline")
+INLINE_UNAVAILABLE_BUTTON = InlineQueryResultsButton("❌ Kurs belum tersedia, buka LiraKuBot", start_parameter="inline")
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer ``@LiraKuBot 500000`` style queries with buy/sell quotes"""
+    query = update.inline_query
+    quotes = inline_quotes.peek()
+    if quotes is None:
+        # No usable rates loaded; the refresher fetches them, ask Telegram to retry soon
+        await query.answer([], cache_time=5, button=INLINE_UNAVAILABLE_BUTTON)
+        return
+    await query.answer(quotes.answer(query.query), cache_time=INLINE_CACHE_TIME, button=INLINE_BUTTON)
 
 async def show_simulation(query):
     """Show exchange rate simulation"""
-    idr_to_try_rate = get_exchange_rate('IDR', 'TRY')
-    try_to_idr_rate = get_exchange_rate('TRY', 'IDR')
-
-    if not idr_to_try_rate or not try_to_idr_rate:
+    simulation = await simulation_cache.get()
+    if simulation is None:
         await query.edit_message_text(
             "❌ Gagal mengambil data kurs. Silakan coba lagi.",
-            reply_markup=get_back_menu_keyboard()
+            reply_markup=BACK_MENU_KEYBOARD
         )
         return
 
-    # Calculate simulation values with 2.5% margin (hidden from user)
-    simulation_message = (
-        "💱 **Simulasi Tukar IDR ke TRY**\n"
-        f"💸 Rp100.000 → 🇹🇷 ₺{(100000 * idr_to_try_rate * 0.975):.2f}\n"
-        f"💸 Rp500.000 → 🇹🇷 ₺{(500000 * idr_to_try_rate * 0.975):.2f}\n"
-        f"💸 Rp1.000.000 → 🇹🇷 ₺{(1000000 * idr_to_try_rate * 0.975):.2f}\n\n"
-        "💱 **Simulasi Tukar TRY ke IDR**\n"
-        f"🇹🇷 ₺100 → {format_currency(100 * try_to_idr_rate * 0.975)}\n"
-        f"🇹🇷 ₺500 → {format_currency(500 * try_to_idr_rate * 0.975)}\n"
-        f"🇹🇷 ₺1.000 → {format_currency(1000 * try_to_idr_rate * 0.975)}\n\n"
-        f"*Simulasi di atas belum termasuk biaya admin*\n"
-        f"*Update: {datetime.now().strftime('%H:%M %d/%m/%Y')}*"
-    )
-
+    simulation_message, keyboard = simulation
     await query.edit_message_text(
         simulation_message,
-        reply_markup=get_back_menu_keyboard(),
+        reply_markup=keyboard,
         parse_mode='Markdown'
     )
 
 async def handle_buy_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle buy amount input"""
     try:
-        amount = int(update.message.text.replace('.', '').replace(',', ''))
+        amount = parse_idr(update.message.text)
 
-        if amount < 100000:
+        if amount < MIN_BUY_AMOUNT:
             await update.message.reply_text(
                 "❌ Minimal pembelian adalah Rp100.000\n"
                 "Silakan masukkan nominal yang valid.",
-                reply_markup=get_back_menu_keyboard()
+                reply_markup=BACK_MENU_KEYBOARD
             )
             return WAITING_BUY_AMOUNT
 
-        # Get exchange rate
-        base_rate = get_exchange_rate('IDR', 'TRY')
-        if not base_rate:
+        prices = await get_prices()
+        if prices is None:
             await update.message.reply_text(
                 "❌ Gagal mengambil data kurs. Silakan coba lagi.",
-                reply_markup=get_back_menu_keyboard()
+                reply_markup=BACK_MENU_KEYBOARD
             )
             return WAITING_BUY_AMOUNT
 
-        # Calculate TRY with 2.5% margin (hidden from user)
-        estimated_try = amount * base_rate * 0.975
+        # TRY after the hidden margin
+        estimated_try = prices.quote_buy(amount).try_amount
 
         # Store in context
         context.user_data['buy_amount_idr'] = amount
         context.user_data['buy_estimated_try'] = estimated_try
-        context.user_data['current_state'] = 'buy_name'
+        return await enter_step(update.message.reply_text, 'buy_name', context)
 
-        await update.message.reply_text(
-            f"💰 **Estimasi Konversi**\n\n"
-            f"💸 Nominal: {format_currency(amount)}\n"
-            f"🇹🇷 Estimasi TRY: ₺{estimated_try:.2f}\n\n"
-            f"Masukkan nama lengkap sesuai IBAN Anda:",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        return WAITING_BUY_NAME
-
-    except ValueError:
+    except (ValueError, InvalidOperation):
         await update.message.reply_text(
             "❌ Format nominal tidak valid. Masukkan angka saja.\n"
             "Contoh: 500000",
-            reply_markup=get_back_menu_keyboard()
+            reply_markup=BACK_MENU_KEYBOARD
         )
         return WAITING_BUY_AMOUNT
 
@@ -498,21 +592,24 @@ async def handle_buy_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(name) < 2:
         await update.message.reply_text(
             "❌ Nama terlalu pendek. Masukkan nama lengkap yang valid.",
-            reply_markup=get_back_menu_keyboard()
+            reply_markup=BACK_MENU_KEYBOARD
         )
         return WAITING_BUY_NAME
 
     context.user_data['buy_name'] = name
-    context.user_data['current_state'] = 'buy_iban'
+    return await enter_step(update.message.reply_text, 'buy_iban', context)
 
-    await update.message.reply_text(
-        f"👤 Nama: **{name}**\n\n"
-        f"Masukkan IBAN Turki Anda (format: TR + 24 angka)\n"
-        f"Contoh: `TR123456789012345678901234`",
-        reply_markup=get_back_menu_keyboard(),
-        parse_mode='Markdown'
+def buy_confirmation_message(name, iban, amount, try_amount, total):
+    return (
+        "📋 **Konfirmasi Detail Pembelian**\n\n"
+        f"👤 **Nama:** {markdown_text(name)}\n"
+        f"🏦 **IBAN:** `{code_text(iban)}`\n"
+        f"💸 **Nominal konversi:** {format_idr(amount)}\n"
+        f"🇹🇷 **TRY yang diterima:** ₺{try_amount:.2f}\n"
+        f"💼 **Biaya admin:** {ADMIN_FEE_TEXT}\n"
+        f"💰 **Total pembayaran:** {format_idr(total)}\n\n"
+        "Apakah data sudah benar?"
     )
-    return WAITING_BUY_IBAN
 
 async def handle_buy_iban(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle buy IBAN input"""
@@ -523,7 +620,7 @@ async def handle_buy_iban(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "❌ IBAN harus dimulai dengan 'TR' untuk Turki.\n"
             "Contoh: `TR123456789012345678901234`",
-            reply_markup=get_back_menu_keyboard(),
+            reply_markup=BACK_MENU_KEYBOARD,
             parse_mode='Markdown'
         )
         return WAITING_BUY_IBAN
@@ -535,7 +632,7 @@ async def handle_buy_iban(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📏 Minimal: 24 karakter\n"
             f"📏 Standar Turki: 26 karakter (TR + 24 angka)\n\n"
             f"Contoh: `TR123456789012345678901234`",
-            reply_markup=get_back_menu_keyboard(),
+            reply_markup=BACK_MENU_KEYBOARD,
             parse_mode='Markdown'
         )
         return WAITING_BUY_IBAN
@@ -547,7 +644,7 @@ async def handle_buy_iban(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📏 Maksimal: 28 karakter\n"
             f"📏 Standar Turki: 26 karakter (TR + 24 angka)\n\n"
             f"Contoh: `TR123456789012345678901234`",
-            reply_markup=get_back_menu_keyboard(),
+            reply_markup=BACK_MENU_KEYBOARD,
             parse_mode='Markdown'
         )
         return WAITING_BUY_IBAN
@@ -557,7 +654,7 @@ async def handle_buy_iban(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "❌ IBAN harus berupa 'TR' diikuti angka saja.\n"
             "Tidak boleh ada huruf setelah 'TR'.\n\n"
             f"Contoh: `TR123456789012345678901234`",
-            reply_markup=get_back_menu_keyboard(),
+            reply_markup=BACK_MENU_KEYBOARD,
             parse_mode='Markdown'
         )
         return WAITING_BUY_IBAN
@@ -572,20 +669,12 @@ async def handle_buy_iban(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     context.user_data['buy_total_payment'] = total_payment
 
-    confirmation_message = (
-        "📋 **Konfirmasi Detail Pembelian**\n\n"
-        f"👤 **Nama:** {context.user_data['buy_name']}\n"
-        f"🏦 **IBAN:** `{iban}`\n"
-        f"💸 **Nominal konversi:** {format_currency(amount)}\n"
-        f"🇹🇷 **TRY yang diterima:** ₺{estimated_try:.2f}\n"
-        f"💼 **Biaya admin:** {format_currency(ADMIN_FEE)}\n"
-        f"💰 **Total pembayaran:** {format_currency(total_payment)}\n\n"
-        f"Apakah data sudah benar?"
-    )
-
     await update.message.reply_text(
-        confirmation_message,
-        reply_markup=get_confirmation_keyboard(),
+        buy_confirmation_message(
+            name=context.user_data['buy_name'], iban=iban, amount=amount,
+            try_amount=estimated_try, total=total_payment
+        ),
+        reply_markup=CONFIRMATION_KEYBOARD,
         parse_mode='Markdown'
     )
     return WAITING_BUY_CONFIRMATION
@@ -593,48 +682,39 @@ async def handle_buy_iban(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_sell_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle sell amount input"""
     try:
-        amount = float(update.message.text.replace(',', '.'))
+        amount = parse_try(update.message.text)
 
         if amount <= 0:
             await update.message.reply_text(
                 "❌ Jumlah harus lebih dari 0.\n"
                 "Silakan masukkan jumlah yang valid.",
-                reply_markup=get_back_menu_keyboard()
+                reply_markup=BACK_MENU_KEYBOARD
             )
             return WAITING_SELL_AMOUNT
 
-        # Get exchange rate
-        base_rate = get_exchange_rate('TRY', 'IDR')
-        if not base_rate:
+        prices = await get_prices()
+        if prices is None:
             await update.message.reply_text(
                 "❌ Gagal mengambil data kurs. Silakan coba lagi.",
-                reply_markup=get_back_menu_keyboard()
+                reply_markup=BACK_MENU_KEYBOARD
             )
             return WAITING_SELL_AMOUNT
 
-        # Calculate dengan margin 2.5% (hidden from user)
-        estimated_idr_gross = amount * base_rate * 0.975
+        # IDR after the hidden margin, before the admin fee
+        quote = prices.quote_sell(amount)
+        amount = quote.amount_try
+        estimated_idr_gross = quote.idr_gross
 
         # Store in context
         context.user_data['sell_amount_try'] = amount
         context.user_data['sell_estimated_idr_gross'] = estimated_idr_gross
-        context.user_data['current_state'] = 'sell_name'
+        return await enter_step(update.message.reply_text, 'sell_name', context)
 
-        await update.message.reply_text(
-            f"💰 **Estimasi Konversi**\n\n"
-            f"🇹🇷 Lira: ₺{amount:,.2f}\n"
-            f"💵 Estimasi IDR: {format_currency(estimated_idr_gross)}\n\n"
-            f"Masukkan nama lengkap Anda:",
-            reply_markup=get_back_menu_keyboard(),
-            parse_mode='Markdown'
-        )
-        return WAITING_SELL_NAME
-
-    except ValueError:
+    except (ValueError, InvalidOperation):
         await update.message.reply_text(
             "❌ Format jumlah tidak valid. Masukkan angka saja.\n"
             "Contoh: 100 atau 100.50",
-            reply_markup=get_back_menu_keyboard()
+            reply_markup=BACK_MENU_KEYBOARD
         )
         return WAITING_SELL_AMOUNT
 
@@ -645,22 +725,24 @@ async def handle_sell_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(name) < 2:
         await update.message.reply_text(
             "❌ Nama terlalu pendek. Masukkan nama lengkap yang valid.",
-            reply_markup=get_back_menu_keyboard()
+            reply_markup=BACK_MENU_KEYBOARD
         )
         return WAITING_SELL_NAME
 
     context.user_data['sell_name'] = name
-    context.user_data['current_state'] = 'sell_account'
+    return await enter_step(update.message.reply_text, 'sell_account', context)
 
-    await update.message.reply_text(
-        f"👤 Nama: **{name}**\n\n"
-        "Masukkan nomor rekening bank Indonesia Anda.\n"
-        "Format: [Nama Bank] - [Nomor Rekening]\n"
-        "Contoh: `BCA - 1234567890`",
-        reply_markup=get_back_menu_keyboard(),
-        parse_mode='Markdown'
+def sell_confirmation_message(name, account, amount, gross, net):
+    return (
+        "📋 **Konfirmasi Detail Penjualan**\n\n"
+        f"👤 **Nama:** {markdown_text(name)}\n"
+        f"🏦 **Rekening:** `{code_text(account)}`\n"
+        f"🪙 **TRY yang dikirim:** ₺{amount:,.2f}\n"
+        f"💵 **IDR sebelum potongan:** {format_idr(gross)}\n"
+        f"💼 **Biaya admin:** {ADMIN_FEE_TEXT}\n"
+        f"💰 **IDR yang diterima:** {format_idr(net)}\n\n"
+        "Apakah data sudah benar?"
     )
-    return WAITING_SELL_ACCOUNT
 
 async def handle_sell_account(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle sell account input"""
@@ -671,7 +753,7 @@ async def handle_sell_account(update: Update, context: ContextTypes.DEFAULT_TYPE
             "❌ Format rekening tidak valid.\n"
             "Format: [Nama Bank] - [Nomor Rekening]\n"
             "Contoh: `BCA - 1234567890`",
-            reply_markup=get_back_menu_keyboard(),
+            reply_markup=BACK_MENU_KEYBOARD,
             parse_mode='Markdown'
         )
         return WAITING_SELL_ACCOUNT
@@ -689,31 +771,49 @@ async def handle_sell_account(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(
             "❌ Jumlah Lira terlalu kecil. Setelah dikurangi biaya admin, nilai akan negatif.\n"
             "Silakan masukkan jumlah yang lebih besar.",
-            reply_markup=get_back_menu_keyboard()
+            reply_markup=BACK_MENU_KEYBOARD
         )
         context.user_data['current_state'] = 'sell_account'
         return WAITING_SELL_ACCOUNT
 
     context.user_data['sell_estimated_idr_net'] = estimated_idr_net
 
-    confirmation_message = (
-        "📋 **Konfirmasi Detail Penjualan**\n\n"
-        f"👤 **Nama:** {context.user_data['sell_name']}\n"
-        f"🏦 **Rekening:** `{account}`\n"
-        f"🪙 **TRY yang dikirim:** ₺{amount:,.2f}\n"
-        f"💵 **IDR sebelum potongan:** {format_currency(estimated_idr_gross)}\n"
-        f"💼 **Biaya admin:** {format_currency(ADMIN_FEE)}\n"
-        f"💰 **IDR yang diterima:** {format_currency(estimated_idr_net)}\n\n"
-        f"Apakah data sudah benar?"
-    )
-
     await update.message.reply_text(
-        confirmation_message,
-        reply_markup=get_confirmation_keyboard(),
+        sell_confirmation_message(
+            name=context.user_data['sell_name'], account=account, amount=amount,
+            gross=estimated_idr_gross, net=estimated_idr_net
+        ),
+        reply_markup=CONFIRMATION_KEYBOARD,
         parse_mode='Markdown'
     )
     return WAITING_SELL_CONFIRMATION
 
+def payment_details_message(name, iban, try_amount, total):
+    return (
+        "💳 **Detail Pembayaran**\n\n"
+        f"👤 **Nama:** {markdown_text(name)}\n"
+        f"🏦 **IBAN:** `{code_text(iban)}`\n"
+        f"🇹🇷 **TRY yang diterima:** ₺{try_amount:.2f}\n"
+        f"💰 **Total pembayaran:** {format_idr(total)}\n\n"
+        "💳 **Transfer ke:**\n"
+        "🏦 Bank: BCA\n"
+        "💳 Rekening: `7645257260`\n"
+        "👤 a.n. Muhammad Haikal Sutanto\n\n"
+        "Setelah transfer, klik tombol di bawah:"
+    )
+
+def transfer_details_message(name, account, amount, net):
+    return (
+        "💸 **Detail Transfer Lira**\n\n"
+        f"👤 **Nama:** {markdown_text(name)}\n"
+        f"🏦 **Rekening Anda:** `{code_text(account)}`\n"
+        f"🪙 **TRY yang dikirim:** ₺{amount:,.2f}\n"
+        f"💰 **IDR yang diterima:** {format_idr(net)}\n\n"
+        "🏦 **Kirim Lira ke IBAN Admin:**\n"
+        f"`{ADMIN_IBAN}`\n\n"
+        "Setelah mengirim, klik tombol di bawah:"
+    )
+
 async def handle_transaction_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle transaction confirmation"""
     query = update.callback_query
@@ -726,24 +826,15 @@ async def handle_transaction_confirmation(update: Update, context: ContextTypes.
         total_payment = context.user_data['buy_total_payment']
         iban = context.user_data['buy_iban']
 
-        payment_message = (
-            "💳 **Detail Pembayaran**\n\n"
-            f"👤 **Nama:** {context.user_data['buy_name']}\n"
-            f"🏦 **IBAN:** `{iban}`\n"
-            f"🇹🇷 **TRY yang diterima:** ₺{estimated_try:.2f}\n"
-            f"💰 **Total pembayaran:** {format_currency(total_payment)}\n\n"
-            f"💳 **Transfer ke:**\n"
-            f"🏦 Bank: BCA\n"
-            f"💳 Rekening: `7645257260`\n"
-            f"👤 a.n. Muhammad Haikal Sutanto\n\n"
-            f"Setelah transfer, klik tombol di bawah:"
-        )
-
         await query.edit_message_text(
-            payment_message,
-            reply_markup=get_payment_keyboard(),
+            payment_details_message(
+                name=context.user_data['buy_name'], iban=iban, try_amount=estimated_try, total=total_payment
+            ),
+            reply_markup=PAYMENT_KEYBOARD,
             parse_mode='Markdown'
         )
+        # Stay in the conversation so "back" on the payment screen can still edit the order
+        return WAITING_BUY_CONFIRMATION
 
     elif current_state == 'sell_confirmation':
         # Show transfer details for sell transaction
@@ -751,31 +842,53 @@ async def handle_transaction_confirmation(update: Update, context: ContextTypes.
         estimated_idr_net = context.user_data['sell_estimated_idr_net']
         account = context.user_data['sell_account']
 
-        transfer_message = (
-            "💸 **Detail Transfer Lira**\n\n"
-            f"👤 **Nama:** {context.user_data['sell_name']}\n"
-            f"🏦 **Rekening Anda:** `{account}`\n"
-            f"🪙 **TRY yang dikirim:** ₺{amount:,.2f}\n"
-            f"💰 **IDR yang diterima:** {format_currency(estimated_idr_net)}\n\n"
-            f"🏦 **Kirim Lira ke IBAN Admin:**\n"
-            f"`{ADMIN_IBAN}`\n\n"
-            f"Setelah mengirim, klik tombol di bawah:"
-        )
-
-        keyboard = [
-            [InlineKeyboardButton("✅ Saya sudah kirim", callback_data="sell_sent")],
-            [InlineKeyboardButton("🔙 Kembali", callback_data="back")],
-            [InlineKeyboardButton("🏠 Menu Utama", callback_data="main_menu")]
-        ]
-
         await query.edit_message_text(
-            transfer_message,
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            transfer_details_message(
+                name=context.user_data['sell_name'], account=account, amount=amount, net=estimated_idr_net
+            ),
+            reply_markup=SELL_SENT_KEYBOARD,
             parse_mode='Markdown'
         )
+        return WAITING_SELL_CONFIRMATION
 
     return ConversationHandler.END
 
+SAVE_STATUS = {True: '✅ Berhasil', False: '❌ Gagal'}
+
+# Admin notifications show the hidden margin; user receipts never do
+def buy_admin_message(name, username, user_id, iban, amount, total, try_amount, time, saved):
+    return (
+        "🔔 **PESANAN MASUK - Beli Lira**\n\n"
+        f"👤 **Nama:** {markdown_text(name)}\n"
+        f"🆔 **Username:** @{markdown_text(username)}\n"
+        f"🆔 **User ID:** {user_id}\n"
+        f"🏦 **IBAN:** `{code_text(iban)}`\n"
+        f"💸 **Nominal konversi:** {format_idr(amount)}\n"
+        f"💼 **Biaya admin:** {ADMIN_FEE_TEXT}\n"
+        f"💰 **Total pembayaran:** {format_idr(total)}\n"
+        f"🇹🇷 **TRY Dikirim:** ₺{try_amount:.2f}\n"
+        f"📊 **Margin tersembunyi:** {MARGIN_PERCENT}% dari konversi\n"
+        f"⏰ **Waktu:** {time}\n"
+        f"💾 **Status Simpan:** {saved}\n\n"
+        "**Silakan verifikasi pembayaran dan proses transaksi ini.**"
+    )
+
+def buy_receipt_message(total, iban, try_amount):
+    return (
+        "✅ **Konfirmasi Pembayaran Diterima!**\n\n"
+        "Terima kasih! Transaksi Anda sedang diproses.\n"
+        "Admin akan segera memverifikasi pembayaran dan mengirim Lira ke IBAN Anda.\n\n"
+        "🏦 **Detail Transfer Anda:**\n"
+        "💳 Rekening: `7645257260` (BCA)\n"
+        "👤 a.n. Muhammad Haikal Sutanto\n"
+        f"💰 Jumlah: {format_idr(total)}\n\n"
+        f"🇹🇷 **IBAN Tujuan:** `{code_text(iban)}`\n"
+        f"₺ **TRY yang akan diterima:** ₺{try_amount:.2f}\n\n"
+        "📱 **Estimasi Waktu Proses:** 5-15 menit\n"
+        "💬 **Jika ada pertanyaan:** @lirakuid\n\n"
+        "Kami akan mengirim notifikasi setelah transfer selesai."
+    )
+
 async def handle_payment_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle payment confirmation"""
     query = update.callback_query
@@ -785,9 +898,9 @@ async def handle_payment_confirmation(update: Update, context: ContextTypes.DEFA
     if not all(key in context.user_data for key in ['buy_name', 'buy_iban', 'buy_amount_idr', 'buy_estimated_try', 'buy_total_payment']):
         await query.edit_message_text(
             "❌ Data transaksi tidak lengkap. Silakan mulai transaksi baru.",
-            reply_markup=get_main_keyboard()
+            reply_markup=MAIN_KEYBOARD
         )
-        return
+        return ConversationHandler.END
 
     # Prepare transaction data
     now = datetime.now()
@@ -796,66 +909,75 @@ async def handle_payment_confirmation(update: Update, context: ContextTypes.DEFA
         context.user_data.get('buy_name', ''),
         context.user_data.get('buy_iban', ''),
         context.user_data.get('buy_total_payment', 0),
-        round(context.user_data.get('buy_estimated_try', 0), 2),
-        'Menunggu Konfirmasi',
+        float(context.user_data.get('buy_estimated_try', 0)),
+        STATUS_PENDING,
         user.username or '',
         str(user.id),
         'Beli Lira'
     ]
 
     # Save transaction
-    save_success = save_transaction(transaction_data)
+    save_success = await save_transaction(transaction_data)
 
     # Send notification to admin (show margin details for admin)
-    admin_message = (
-        "🔔 **PESANAN MASUK - Beli Lira**\n\n"
-        f"👤 **Nama:** {context.user_data.get('buy_name', '')}\n"
-        f"🆔 **Username:** @{user.username or 'Tidak ada'}\n"
-        f"🆔 **User ID:** {user.id}\n"
-        f"🏦 **IBAN:** `{context.user_data.get('buy_iban', '')}`\n"
-        f"💸 **Nominal konversi:** {format_currency(context.user_data.get('buy_amount_idr', 0))}\n"
-        f"💼 **Biaya admin:** {format_currency(ADMIN_FEE)}\n"
-        f"💰 **Total pembayaran:** {format_currency(context.user_data.get('buy_total_payment', 0))}\n"
-        f"🇹🇷 **TRY Dikirim:** ₺{context.user_data.get('buy_estimated_try', 0):.2f}\n"
-        f"📊 **Margin tersembunyi:** 2.5% dari konversi\n"
-        f"⏰ **Waktu:** {now.strftime('%d/%m/%Y %H:%M:%S')}\n"
-        f"💾 **Status Simpan:** {'✅ Berhasil' if save_success else '❌ Gagal'}\n\n"
-        f"**Silakan verifikasi pembayaran dan proses transaksi ini.**"
+    data = context.user_data
+    admin_message = buy_admin_message(
+        name=data.get('buy_name', ''), username=user.username or 'Tidak ada', user_id=user.id,
+        iban=data.get('buy_iban', ''), amount=data.get('buy_amount_idr', 0),
+        total=data.get('buy_total_payment', 0), try_amount=data.get('buy_estimated_try', 0),
+        time=now.strftime('%d/%m/%Y %H:%M:%S'), saved=SAVE_STATUS[save_success]
     )
 
-    try:
-        if ADMIN_CHAT_ID:
-            await context.bot.send_message(
-                chat_id=ADMIN_CHAT_ID,
-                text=admin_message,
-                parse_mode='Markdown'
-            )
-            logger.info(f"Admin notification sent for buy transaction from user {user.id}")
-        else:
-            logger.warning("ADMIN_CHAT_ID not configured, admin notification not sent")
-    except Exception as e:
-        logger.error(f"Error sending admin notification: {e}")
+    # Sent in the background at low priority; the user's confirmation doesn't wait for it
+    admin_notifier.put(admin_message, f"buy transaction from user {user.id}")
 
     # Send confirmation to user (no margin mentioned)
     await query.edit_message_text(
-        "✅ **Konfirmasi Pembayaran Diterima!**\n\n"
-        "Terima kasih! Transaksi Anda sedang diproses.\n"
-        "Admin akan segera memverifikasi pembayaran dan mengirim Lira ke IBAN Anda.\n\n"
-        f"🏦 **Detail Transfer Anda:**\n"
-        f"💳 Rekening: `7645257260` (BCA)\n"
-        f"👤 a.n. Muhammad Haikal Sutanto\n"
-        f"💰 Jumlah: {format_currency(context.user_data.get('buy_total_payment', 0))}\n\n"
-        f"🇹🇷 **IBAN Tujuan:** `{context.user_data.get('buy_iban', '')}`\n"
-        f"₺ **TRY yang akan diterima:** ₺{context.user_data.get('buy_estimated_try', 0):.2f}\n\n"
-        "📱 **Estimasi Waktu Proses:** 5-15 menit\n"
-        "💬 **Jika ada pertanyaan:** @lirakuid\n\n"
-        "Kami akan mengirim notifikasi setelah transfer selesai.",
-        reply_markup=get_back_menu_keyboard(),
+        buy_receipt_message(
+            total=data.get('buy_total_payment', 0), iban=data.get('buy_iban', ''),
+            try_amount=data.get('buy_estimated_try', 0)
+        ),
+        reply_markup=BACK_MENU_KEYBOARD,
         parse_mode='Markdown'
     )
 
     # Clear user data
     context.user_data.clear()
+    return ConversationHandler.END
+
+def sell_admin_message(name, username, user_id, account, amount, gross, net, time, saved):
+    return (
+        "🔔 **PESANAN MASUK - Jual Lira**\n\n"
+        f"👤 **Nama:** {markdown_text(name)}\n"
+        f"🆔 **Username:** @{markdown_text(username)}\n"
+        f"🆔 **User ID:** {user_id}\n"
+        f"🏦 **Rekening:** `{code_text(account)}`\n"
+        f"🪙 **TRY Dikirim:** ₺{amount:,.2f}\n"
+        f"💵 **IDR gross (dengan margin):** {format_idr(gross)}\n"
+        f"💼 **Biaya admin:** {ADMIN_FEE_TEXT}\n"
+        f"💰 **IDR yang diterima user:** {format_idr(net)}\n"
+        f"📊 **Margin tersembunyi:** {MARGIN_PERCENT}% dari konversi\n"
+        f"🏦 **IBAN Admin:** `{ADMIN_IBAN}`\n"
+        f"⏰ **Waktu:** {time}\n"
+        f"💾 **Status Simpan:** {saved}\n\n"
+        "**Silakan cek penerimaan Lira dan proses transfer IDR.**"
+    )
+
+def sell_receipt_message(amount, account, net):
+    return (
+        "✅ **Konfirmasi Pengiriman Diterima!**\n\n"
+        "Terima kasih! Transaksi Anda sedang diproses.\n"
+        "Admin akan segera memverifikasi penerimaan Lira dan mengirim Rupiah ke rekening Anda.\n\n"
+        "🏦 **IBAN Admin (tujuan kirim Lira):**\n"
+        f"`{ADMIN_IBAN}`\n"
+        f"🪙 **TRY yang Anda kirim:** ₺{amount:,.2f}\n\n"
+        "🏦 **Rekening Anda (tujuan IDR):**\n"
+        f"`{code_text(account)}`\n"
+        f"💰 **IDR yang akan diterima:** {format_idr(net)}\n\n"
+        "📱 **Estimasi Waktu Proses:** 5-15 menit\n"
+        "💬 **Jika ada pertanyaan:** @lirakuid\n\n"
+        "Kami akan mengirim notifikasi setelah transfer selesai."
+    )
 
 async def handle_sell_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle sell confirmation"""
@@ -866,9 +988,9 @@ async def handle_sell_confirmation(update: Update, context: ContextTypes.DEFAULT
     if not all(key in context.user_data for key in ['sell_name', 'sell_account', 'sell_amount_try', 'sell_estimated_idr_net']):
         await query.edit_message_text(
             "❌ Data transaksi tidak lengkap. Silakan mulai transaksi baru.",
-            reply_markup=get_main_keyboard()
+            reply_markup=MAIN_KEYBOARD
         )
-        return
+        return ConversationHandler.END
 
     # Prepare transaction data
     now = datetime.now()
@@ -877,76 +999,215 @@ async def handle_sell_confirmation(update: Update, context: ContextTypes.DEFAULT
         context.user_data.get('sell_name', ''),
         context.user_data.get('sell_account', ''),
         round(context.user_data.get('sell_estimated_idr_net', 0)),
-        context.user_data.get('sell_amount_try', 0),
-        'Menunggu Konfirmasi',
+        float(context.user_data.get('sell_amount_try', 0)),
+        STATUS_PENDING,
         user.username or '',
         str(user.id),
         'Jual Lira'
     ]
 
     # Save transaction
-    save_success = save_transaction(transaction_data)
+    save_success = await save_transaction(transaction_data)
 
     # Send notification to admin (show margin details for admin)
-    admin_message = (
-        "🔔 **PESANAN MASUK - Jual Lira**\n\n"
-        f"👤 **Nama:** {context.user_data.get('sell_name', '')}\n"
-        f"🆔 **Username:** @{user.username or 'Tidak ada'}\n"
-        f"🆔 **User ID:** {user.id}\n"
-        f"🏦 **Rekening:** `{context.user_data.get('sell_account', '')}`\n"
-        f"🪙 **TRY Dikirim:** ₺{context.user_data.get('sell_amount_try', 0):,.2f}\n"
-        f"💵 **IDR gross (dengan margin):** {format_currency(context.user_data.get('sell_estimated_idr_gross', 0))}\n"
-        f"💼 **Biaya admin:** {format_currency(ADMIN_FEE)}\n"
-        f"💰 **IDR yang diterima user:** {format_currency(context.user_data.get('sell_estimated_idr_net', 0))}\n"
-        f"📊 **Margin tersembunyi:** 2.5% dari konversi\n"
-        f"🏦 **IBAN Admin:** `{ADMIN_IBAN}`\n"
-        f"⏰ **Waktu:** {now.strftime('%d/%m/%Y %H:%M:%S')}\n"
-        f"💾 **Status Simpan:** {'✅ Berhasil' if save_success else '❌ Gagal'}\n\n"
-        f"**Silakan cek penerimaan Lira dan proses transfer IDR.**"
+    data = context.user_data
+    admin_message = sell_admin_message(
+        name=data.get('sell_name', ''), username=user.username or 'Tidak ada', user_id=user.id,
+        account=data.get('sell_account', ''), amount=data.get('sell_amount_try', 0),
+        gross=data.get('sell_estimated_idr_gross', 0), net=data.get('sell_estimated_idr_net', 0),
+        time=now.strftime('%d/%m/%Y %H:%M:%S'), saved=SAVE_STATUS[save_success]
     )
 
-    try:
-        if ADMIN_CHAT_ID:
-            await context.bot.send_message(
-                chat_id=ADMIN_CHAT_ID,
-                text=admin_message,
-                parse_mode='Markdown'
-            )
-            logger.info(f"Admin notification sent for sell transaction from user {user.id}")
-        else:
-            logger.warning("ADMIN_CHAT_ID not configured, admin notification not sent")
-    except Exception as e:
-        logger.error(f"Error sending admin notification: {e}")
+    # Sent in the background at low priority; the user's confirmation doesn't wait for it
+    admin_notifier.put(admin_message, f"sell transaction from user {user.id}")
 
     # Send confirmation to user (no margin mentioned)
     await query.edit_message_text(
-        "✅ **Konfirmasi Pengiriman Diterima!**\n\n"
-        "Terima kasih! Transaksi Anda sedang diproses.\n"
-        "Admin akan segera memverifikasi penerimaan Lira dan mengirim Rupiah ke rekening Anda.\n\n"
-        f"🏦 **IBAN Admin (tujuan kirim Lira):**\n"
-        f"`{ADMIN_IBAN}`\n"
-        f"🪙 **TRY yang Anda kirim:** ₺{context.user_data.get('sell_amount_try', 0):,.2f}\n\n"
-        f"🏦 **Rekening Anda (tujuan IDR):**\n"
-        f"`{context.user_data.get('sell_account', '')}`\n"
-        f"💰 **IDR yang akan diterima:** {format_currency(context.user_data.get('sell_estimated_idr_net', 0))}\n\n"
-        "📱 **Estimasi Waktu Proses:** 5-15 menit\n"
-        "💬 **Jika ada pertanyaan:** @lirakuid\n\n"
-        "Kami akan mengirim notifikasi setelah transfer selesai.",
-        reply_markup=get_back_menu_keyboard(),
+        sell_receipt_message(
+            amount=data.get('sell_amount_try', 0), account=data.get('sell_account', ''),
+            net=data.get('sell_estimated_idr_net', 0)
+        ),
+        reply_markup=BACK_MENU_KEYBOARD,
         parse_mode='Markdown'
     )
 
     # Clear user data
     context.user_data.clear()
+    return ConversationHandler.END
+
+# callback_data -> route; each route returns the next conversation state (None keeps the current one)
+CALLBACK_ROUTES = {
+    'main_menu': show_main_menu,
+    'buy_lira': start_buy,
+    'sell_lira': start_sell,
+    'simulation': lambda update, context: show_simulation(update.callback_query),
+    'contact_admin': show_contact_admin,
+    'confirm_transaction': handle_transaction_confirmation,
+    'payment_sent': handle_payment_confirmation,
+    'sell_sent': handle_sell_confirmation,
+    'back': handle_back_navigation,
+}
+
+# Callbacks that start the trade conversation
+ENTRY_CALLBACKS = frozenset({'buy_lira', 'sell_lira'})
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel conversation"""
     await update.message.reply_text(
         "❌ Transaksi dibatalkan.",
-        reply_markup=get_main_keyboard()
+        reply_markup=MAIN_KEYBOARD
     )
     return ConversationHandler.END
 
+def format_transaction_line(row):
+    """One-line summary of a journaled transaction row"""
+    waktu, nama, _, idr, try_amount, status, _, _, jenis = row
+    return f"• {waktu} | {jenis} | {nama} | {format_currency(idr)} | ₺{try_amount:,.2f} | {status}"
+
+def is_admin_chat(update):
+    return bool(ADMIN_CHAT_ID) and str(update.effective_chat.id) == str(ADMIN_CHAT_ID)
+
+# /pesanan argument -> transaction type
+ORDER_KINDS = {'beli': 'Beli Lira', 'jual': 'Jual Lira'}
+
+async def pending_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: list transactions still waiting for confirmation, optionally of one type"""
+    if not is_admin_chat(update):
+        return
+
+    kind = ORDER_KINDS.get(context.args[0].lower()) if context.args else None
+    entries = await asyncio.to_thread(journal.by_status, STATUS_PENDING, kind, 20)
+    if not entries:
+        await update.message.reply_text("✅ Tidak ada pesanan yang menunggu konfirmasi.")
+        return
+
+    lines = [f"#{entry_id} {format_transaction_line(row)}" for entry_id, row in entries]
+    await update.message.reply_text(
+        f"🕒 Pesanan menunggu konfirmasi ({len(entries)} terbaru):\n\n" + "\n".join(lines) +
+        "\n\nTandai selesai dengan /selesai <nomor>"
+    )
+
+async def complete_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: mark an order from /pesanan as done"""
+    if not is_admin_chat(update):
+        return
+
+    if len(context.args) != 1 or not context.args[0].lstrip('#').isdigit():
+        await update.message.reply_text("Format: /selesai <nomor pesanan>, contoh: /selesai 12")
+        return
+    entry_id = int(context.args[0].lstrip('#'))
+    if await asyncio.to_thread(journal.set_status, entry_id, STATUS_DONE):
+        await update.message.reply_text(f"✅ Pesanan #{entry_id} ditandai selesai.")
+    else:
+        await update.message.reply_text(f"❌ Pesanan #{entry_id} tidak ditemukan.")
+
+async def transaction_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the user's latest transactions"""
+    entries = await asyncio.to_thread(journal.by_user, update.effective_user.id, limit=10)
+    if not entries:
+        await update.message.reply_text(
+            "Belum ada transaksi.",
+            reply_markup=MAIN_KEYBOARD
+        )
+        return
+
+    lines = [format_transaction_line(row) for _, row in entries]
+    await update.message.reply_text(
+        "🧾 Riwayat transaksi Anda:\n\n" + "\n".join(lines),
+        reply_markup=MAIN_KEYBOARD
+    )
+
+def build_application(request=None):
+    """Create the Application and register all handlers
+
+    ``request`` overrides the Bot API transport (used by the load test).
+    """
+    request = request or metrics.InstrumentedRequest(connection_pool_size=256)
+    update_processor = PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES)
+    # Create application with error handling
+    try:
+        application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .post_init(post_init)
+            .post_stop(post_stop)
+            .post_shutdown(post_shutdown)
+            .persistence(SQLitePersistence(PERSISTENCE_PATH, update_interval=PERSISTENCE_INTERVAL))
+            .concurrent_updates(update_processor)
+            .rate_limiter(PriorityRateLimiter())
+            .request(request)
+            .build()
+        )
+    except Exception as e:
+        logger.error(f"Error creating application: {e}")
+        # Try alternative method
+        from telegram.ext import ApplicationBuilder
+        application = (
+            ApplicationBuilder()
+            .token(BOT_TOKEN)
+            .post_init(post_init)
+            .post_stop(post_stop)
+            .post_shutdown(post_shutdown)
+            .persistence(SQLitePersistence(PERSISTENCE_PATH, update_interval=PERSISTENCE_INTERVAL))
+            .concurrent_updates(update_processor)
+            .rate_limiter(PriorityRateLimiter())
+            .request(request)
+            .build()
+        )
+
+    # One conversation for both trades: text input goes to the current step's
+    # handler, every button goes through the button_handler route table
+    trade_conv_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(button_handler, pattern=ENTRY_CALLBACKS.__contains__)],
+        states={
+            WAITING_BUY_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_buy_amount)],
+            WAITING_BUY_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_buy_name)],
+            WAITING_BUY_IBAN: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_buy_iban)],
+            WAITING_BUY_CONFIRMATION: [],
+            WAITING_SELL_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_sell_amount)],
+            WAITING_SELL_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_sell_name)],
+            WAITING_SELL_ACCOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_sell_account)],
+            WAITING_SELL_CONFIRMATION: [],
+        },
+        fallbacks=[
+            CommandHandler('cancel', cancel),
+            CallbackQueryHandler(button_handler)
+        ],
+        allow_reentry=True,
+        name="trade_conversation",
+        persistent=True
+    )
+
+    # Add handlers
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("pesanan", pending_orders))
+    application.add_handler(CommandHandler("selesai", complete_order))
+    application.add_handler(CommandHandler("riwayat", transaction_history))
+    application.add_handler(trade_conv_handler)
+    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(InlineQueryHandler(inline_query))
+
+    # Latency histograms for every handler, plus queue depth gauges
+    metrics.instrument_application(application)
+    if PROFILE_MODE != 'off':
+        SlowHandlerProfiler(budget=SLOW_HANDLER_BUDGET_MS / 1000, mode=PROFILE_MODE).instrument(application)
+    metrics.QUEUE_DEPTH.set_function(sheet_queue.qsize, queue='sheet_writes')
+    metrics.QUEUE_DEPTH.set_function(admin_notifier.qsize, queue='admin_notifications')
+    metrics.QUEUE_DEPTH.set_function(lambda: update_processor.waiting, queue='updates_waiting')
+    metrics.UPDATES_IN_FLIGHT.set_function(lambda: update_processor.active)
+    metrics.RATE_QUOTA_USED.set_function(lambda: rate_service.quota.used)
+    metrics.RATE_AGE.set_function(lambda: rate_service.age)
+    metrics.RATE_CIRCUIT_OPEN.set_function(lambda: int(rate_service.breaker.state != rate_service.breaker.CLOSED))
+
+    # Keep exchange rates warm in the background within the API quota
+    if application.job_queue:
+        # Cluster followers pick up the leader's rates instead of spending quota
+        RateRefresher(rate_service, follow=not CLUSTER_LEADER).start(application.job_queue)
+    else:
+        logger.warning("JobQueue not available, exchange rates will only refresh on demand")
+
+    return application
+
 def main():
     """Main function to run the bot"""
     try:
@@ -958,76 +1219,29 @@ def main():
         if not ADMIN_CHAT_ID:
             logger.warning("ADMIN_CHAT_ID tidak ditemukan, notifikasi admin tidak akan dikirim")
 
-        logger.info("Initializing bot application...")
-
-        # Create application with error handling
-        try:
-            application = Application.builder().token(BOT_TOKEN).build()
-        except Exception as e:
-            logger.error(f"Error creating application: {e}")
-            # Try alternative method
-            from telegram.ext import ApplicationBuilder
-            application = ApplicationBuilder().token(BOT_TOKEN).build()
-
-        # Add conversation handler for buy lira
-        buy_conv_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(button_handler, pattern="^buy_lira$")],
-            states={
-                WAITING_BUY_AMOUNT: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_buy_amount),
-                    CallbackQueryHandler(button_handler, pattern="^(back|main_menu)$")
-                ],
-                WAITING_BUY_NAME: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_buy_name),
-                    CallbackQueryHandler(button_handler, pattern="^(back|main_menu)$")
-                ],
-                WAITING_BUY_IBAN: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_buy_iban),
-                    CallbackQueryHandler(button_handler, pattern="^(back|main_menu)$")
-                ],
-                WAITING_BUY_CONFIRMATION: [
-                    CallbackQueryHandler(button_handler, pattern="^(confirm_transaction|back|main_menu)$")
-                ],
-            },
-            fallbacks=[
-                CommandHandler('cancel', cancel),
-                CallbackQueryHandler(button_handler, pattern="^(back|main_menu)$")
-            ],
-            allow_reentry=True
-        )
-
-        # Add conversation handler for sell lira
-        sell_conv_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(button_handler, pattern="^sell_lira$")],
-            states={
-                WAITING_SELL_AMOUNT: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_sell_amount),
-                    CallbackQueryHandler(button_handler, pattern="^(back|main_menu)$")
-                ],
-                WAITING_SELL_NAME: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_sell_name),
-                    CallbackQueryHandler(button_handler, pattern="^(back|main_menu)$")
-                ],
-                WAITING_SELL_ACCOUNT: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_sell_account),
-                    CallbackQueryHandler(button_handler, pattern="^(back|main_menu)$")
-                ],
-                WAITING_SELL_CONFIRMATION: [
-                    CallbackQueryHandler(button_handler, pattern="^(confirm_transaction|back|main_menu)$")
-                ],
-            },
-            fallbacks=[
-                CommandHandler('cancel', cancel),
-                CallbackQueryHandler(button_handler, pattern="^(back|main_menu)$")
-            ],
-            allow_reentry=True
-        )
+        if CLUSTER_ROLE != 'worker' and (CLUSTER_WORKERS or CLUSTER_NODES):
+            if not WEBHOOK_URL:
+                raise ValueError("Mode cluster membutuhkan WEBHOOK_URL")
+            print(f"🤖 LiraKuBot is starting (cluster front-end, {CLUSTER_WORKERS} local workers)...")
+            asyncio.run(run_cluster())
+            return
 
-        # Add handlers
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(buy_conv_handler)
-        application.add_handler(sell_conv_handler)
-        application.add_handler(CallbackQueryHandler(button_handler))
+        logger.info("Initializing bot application...")
+        application = build_application()
+
+        if CLUSTER_ROLE == 'worker':
+            if CLUSTER_SLOT < 0:
+                raise ValueError("Worker cluster membutuhkan CLUSTER_SLOT")
+            # The front-end owns the webhook and forwards this worker's users to it
+            print(f"🤖 LiraKuBot worker {CLUSTER_SLOT} is starting...")
+            asyncio.run(run_webhook(application, register=False))
+            return
+
+        if WEBHOOK_URL:
+            # One asyncio HTTP server handles updates, / and /health
+            print("🤖 LiraKuBot is starting (webhook mode)...")
+            asyncio.run(run_webhook(application))
+            return
 
         # Start keep alive server before polling (IMPORTANT!)
         print("🌐 Starting keep-alive server...")
@@ -1049,9 +1263,137 @@ def main():
         print(f"❌ Error starting bot: {e}")
         return False
 
+async def reload_handed_off(application, update):
+    """Reload the state of a user that another cluster worker served since this one last did"""
+    user, chat = update.effective_user, update.effective_chat
+    persistence = application.persistence
+    if user:
+        await persistence.reload_user_data(user.id, application.user_data[user.id])
+    if chat:
+        await persistence.reload_chat_data(chat.id, application.chat_data[chat.id])
+    if not (user and chat):
+        return
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if not (isinstance(handler, ConversationHandler) and handler.persistent) or handler.per_message:
+                continue
+            key = tuple(value for wanted, value in ((handler.per_chat, chat.id), (handler.per_user, user.id)) if wanted)
+            state = await persistence.reload_conversation(handler.name, key)
+            # PTB reads conversation states from persistence only at startup
+            if state is None:
+                handler._conversations.pop(key, None)
+            else:
+                handler._conversations[key] = state
+    logger.info(f"Reloaded state of user {user.id} handed over from another worker")
+
+def build_web_server(application, host='0.0.0.0'):
+    """HTTP server for webhook mode: Telegram updates, / and /health"""
+    server = WebServer(host, int(os.getenv('PORT', 8080)))
+
+    async def home(request):
+        return text_response("LiraKuBot is alive!")
+
+    async def health(request):
+        return json_response(health_status())
+
+    async def metrics_endpoint(request):
+        return Response(200, metrics.CONTENT_TYPE, metrics.REGISTRY.render().encode())
+
+    async def telegram_update(request):
+        if request.headers.get('x-telegram-bot-api-secret-token') != WEBHOOK_SECRET:
+            return text_response('Forbidden', 403)
+        try:
+            update = Update.de_json(json.loads(request.body), application.bot)
+        except (ValueError, TypeError, KeyError):
+            return text_response('Bad Request', 400)
+        if request.headers.get(HANDOFF_HEADER):
+            await reload_handed_off(application, update)
+        await application.update_queue.put(update)
+        return text_response('OK')
+
+    server.route('GET', '/', home)
+    server.route('GET', '/health', health)
+    server.route('GET', '/metrics', metrics_endpoint)
+    server.route('POST', WEBHOOK_PATH, telegram_update)
+    return server
+
+def shutdown_event():
+    """Event set on SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # e.g. Windows; Ctrl+C still raises KeyboardInterrupt
+    return stop_event
+
+async def set_webhook(bot):
+    await bot.set_webhook(
+        url=WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=True
+    )
+    logger.info(f"Webhook set to {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+async def run_webhook(application, register=True):
+    """Run the bot in webhook mode until SIGINT/SIGTERM
+
+    Cluster workers pass ``register=False``: they listen on WORKER_HOST and
+    only receive the updates the front-end forwards to them.
+    """
+    server = build_web_server(application, host=WORKER_HOST if CLUSTER_ROLE == 'worker' else '0.0.0.0')
+    stop_event = shutdown_event()
+
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    try:
+        await server.start()
+        if register:
+            await set_webhook(application.bot)
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        await post_stop(application)
+        await application.shutdown()
+        await post_shutdown(application)
+
+async def run_cluster():
+    """Run the cluster front-end and its local workers until SIGINT/SIGTERM"""
+    supervisor = WorkerSupervisor(
+        os.path.abspath(__file__), CLUSTER_WORKERS, WORKER_BASE_PORT,
+        # Workers must accept the secret Telegram sends to the front-end
+        env={**os.environ, 'WEBHOOK_SECRET': WEBHOOK_SECRET}
+    )
+    frontend = ClusterFrontend(
+        supervisor.urls + CLUSTER_NODES, WEBHOOK_SECRET, WEBHOOK_PATH,
+        '0.0.0.0', int(os.getenv('PORT', 8080)),
+        health=lambda: {"workers_alive": supervisor.alive()}
+    )
+    stop_event = shutdown_event()
+
+    await supervisor.start()
+    try:
+        await frontend.start()
+        async with Bot(BOT_TOKEN) as bot:
+            await set_webhook(bot)
+        await stop_event.wait()
+    finally:
+        await frontend.stop()
+        await supervisor.stop()
+
 class HealthCheckHandler(BaseHTTPRequestHandler):
     """Simple HTTP handler for health checks (fallback for Render)"""
     def do_GET(self):
+        if self.path == '/metrics':
+            self.send_response(200)
+            self.send_header('Content-type', metrics.CONTENT_TYPE)
+            self.end_headers()
+            self.wfile.write(metrics.REGISTRY.render().encode())
+            return
         self.send_response(200)
         self.send_header('Content-type', 'text/plain')
         self.end_headers()
@@ -1070,7 +1412,10 @@ def start_http_server():
 
 if __name__ == '__main__':
     # Check deployment environment
-    if os.getenv('RENDER'):
+    if WEBHOOK_URL:
+        # Webhook mode serves health checks itself on PORT
+        print("🔧 Webhook mode, no keep-alive thread needed")
+    elif os.getenv('RENDER'):
         # For Render deployment - use HTTP server
         print("🔧 Detected Render environment")
         http_thread = threading.Thread(target=start_http_server, daemon=True)
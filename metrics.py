@@ -0,0 +1,296 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Cap on distinct callback_data label values, so stray callback data can't blow up the series count
+MAX_CALLBACK_LABELS = 50
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base for metrics kept in process memory and rendered in Prometheus text format"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge whose value is set directly or read from a callable at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function, **labels):
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def render(self):
+        for key, function in list(self._functions.items()):
+            try:
+                value = function()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+                continue
+            with self._lock:
+                self._values[key] = value
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {state[-2]!r}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition of every registered metric"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    'lirakubot_handler_duration_seconds', 'Time spent in update handlers',
+    ('handler', 'callback_data')
+))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    'lirakubot_handler_errors_total', 'Exceptions raised by update handlers', ('handler',)
+))
+OUTBOUND_LATENCY = REGISTRY.register(Histogram(
+    'lirakubot_outbound_duration_seconds', 'Latency of calls to external services',
+    ('target', 'operation')
+))
+OUTBOUND_ERRORS = REGISTRY.register(Counter(
+    'lirakubot_outbound_errors_total', 'Failed calls to external services', ('target', 'operation')
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'lirakubot_queue_depth', 'Items waiting in internal queues', ('queue',)
+))
+UPDATES_IN_FLIGHT = REGISTRY.register(Gauge(
+    'lirakubot_updates_in_flight', 'Telegram updates being handled concurrently'
+))
+RATE_QUOTA_USED = REGISTRY.register(Gauge(
+    'lirakubot_rate_quota_used', 'exchangerate-api requests used in the current quota period'
+))
+RATE_AGE = REGISTRY.register(Gauge(
+    'lirakubot_rate_age_seconds', 'Age of the cached exchange rate table'
+))
+RATE_CIRCUIT_OPEN = REGISTRY.register(Gauge(
+    'lirakubot_rate_circuit_open', '1 while the exchange rate API circuit breaker is not closed'
+))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    'lirakubot_startup_seconds', 'Time spent in each startup phase', ('phase',)
+))
+
+
+@contextmanager
+def outbound(target, operation):
+    """Time an outbound call and count it as an error if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        OUTBOUND_ERRORS.inc(target=target, operation=operation)
+        raise
+    finally:
+        OUTBOUND_LATENCY.observe(time.perf_counter() - start, target=target, operation=operation)
+
+
+_callback_labels = set()
+
+
+def callback_label(update):
+    """callback_data of a callback query as a bounded-cardinality label value"""
+    query = getattr(update, 'callback_query', None)
+    data = query.data if query else None
+    if not data:
+        return ''
+    if data in _callback_labels:
+        return data
+    if len(_callback_labels) < MAX_CALLBACK_LABELS and len(data) <= 64:
+        _callback_labels.add(data)
+        return data
+    return 'other'
+
+
+def timed_callback(callback):
+    """Wrap a handler callback so its latency and errors are recorded"""
+    if getattr(callback, '__metrics_wrapped__', False):
+        return callback
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(
+                time.perf_counter() - start, handler=name, callback_data=callback_label(update)
+            )
+
+    wrapper.__metrics_wrapped__ = True
+    return wrapper
+
+
+def iter_handlers(application):
+    """Yield every callback handler registered on the application, including inside conversations"""
+    def walk(handlers):
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                yield from walk(handler.entry_points)
+                for state_handlers in handler.states.values():
+                    yield from walk(state_handlers)
+                yield from walk(handler.fallbacks)
+            else:
+                yield handler
+
+    for group in application.handlers.values():
+        yield from walk(group)
+
+
+def wrap_handlers(application, wrap):
+    """Replace each handler callback with ``wrap(callback)``, wrapping each function once"""
+    wrapped = {}
+    for handler in iter_handlers(application):
+        original = handler.callback
+        if original not in wrapped:
+            wrapped[original] = wrap(original)
+        handler.callback = wrapped[original]
+
+
+def instrument_application(application):
+    """Record latency and errors of every registered handler"""
+    wrap_handlers(application, timed_callback)
+    QUEUE_DEPTH.set_function(application.update_queue.qsize, queue='telegram_updates')
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records the latency of every Bot API call"""
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        with outbound('telegram', endpoint):
+            code, payload = await super().do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+        if code >= 400:
+            OUTBOUND_ERRORS.inc(target='telegram', operation=endpoint)
+        return code, payload
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+
+from telegram.error import BadRequest
+
+import metrics
+from ratelimit import PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+DIGEST_HEADER = "🔔 **RINGKASAN PESANAN** ({count} pesanan)\n\n"
+DIGEST_SEPARATOR = "\n\n➖➖➖➖➖➖➖➖➖➖\n\n"
+
+ADMIN_NOTIFICATIONS = metrics.REGISTRY.register(metrics.Counter(
+    'lirakubot_admin_notifications_total', 'Orders notified to the admin chat', ('mode',)
+))
+ADMIN_MESSAGES = metrics.REGISTRY.register(metrics.Counter(
+    'lirakubot_admin_messages_total', 'Messages sent to the admin chat', ('result',)
+))
+
+_STOP = object()
+
+
+def split_digest(texts, header='', separator=DIGEST_SEPARATOR, limit=MAX_MESSAGE_LENGTH):
+    """Join texts into as few messages as fit ``limit``, breaking only between texts"""
+    messages, current = [], header
+    for text in texts:
+        if current != header and len(current) + len(separator) + len(text) > limit:
+            messages.append(current)
+            current = header
+        current = current + separator + text if current != header else current + text
+    messages.append(current)
+    return messages
+
+
+class AdminNotifier:
+    """Order notifications for the admin chat, coalesced into digests under load
+
+    An order that arrives when nothing was sent in the last ``window``
+    seconds goes out on its own right away. Orders arriving within the
+    window of the previous send are held and sent as one digest when the
+    window closes or ``max_batch`` orders are waiting, so a burst costs a
+    few Bot API calls instead of one per order. Digests that would exceed
+    Telegram's message length are split between orders.
+
+    Messages are sent with ``PRIORITY_BACKGROUND`` so they never hold up
+    replies to users. ``stop`` sends everything still held before returning.
+    """
+
+    def __init__(self, chat_id, window=10.0, max_batch=20, parse_mode='Markdown'):
+        self.chat_id = chat_id
+        self.window = window
+        self.max_batch = max_batch
+        self.parse_mode = parse_mode
+        self._queue = asyncio.Queue()
+        self._bot = None
+        self._task = None
+
+    def put(self, text, description):
+        """Queue one order notification; never blocks"""
+        if not self.chat_id:
+            logger.warning("ADMIN_CHAT_ID not configured, admin notification not sent")
+            return
+        self._queue.put_nowait((text, description))
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def start(self, bot):
+        if self._task is None:
+            self._bot = bot
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Send all held notifications and stop the worker"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_sent = None
+        stopping = False
+
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            # Busy: hold orders until the window since the last send closes
+            if last_sent is not None and loop.time() - last_sent < self.window:
+                deadline = last_sent + self.window
+                while len(batch) < self.max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+            # Fold in whatever queued up meanwhile
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._send(batch)
+            last_sent = loop.time()
+
+        leftover = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                leftover.append(item)
+        for i in range(0, len(leftover), self.max_batch):
+            await self._send(leftover[i:i + self.max_batch])
+
+    async def _send(self, batch):
+        if len(batch) == 1:
+            mode, messages = 'immediate', [batch[0][0]]
+        else:
+            mode = 'digest'
+            messages = split_digest([text for text, _ in batch], DIGEST_HEADER.format(count=len(batch)))
+
+        ok = True
+        for text in messages:
+            try:
+                try:
+                    await self._send_text(text, self.parse_mode)
+                except BadRequest as e:
+                    # e.g. "can't parse entities": plain text still gets every order in it to the admin
+                    logger.warning(f"Admin notification rejected ({e}), resending without formatting")
+                    await self._send_text(text, None)
+                    ADMIN_MESSAGES.inc(result='sent_plain')
+                else:
+                    ADMIN_MESSAGES.inc(result='sent')
+            except Exception as e:
+                ok = False
+                ADMIN_MESSAGES.inc(result='error')
+                logger.error(f"Error sending admin notification: {e}")
+
+        ADMIN_NOTIFICATIONS.inc(len(batch), mode=mode)
+        descriptions = ', '.join(description for _, description in batch)
+        if ok:
+            logger.info(f"Admin notification sent ({mode}) for {descriptions}")
+        else:
+            logger.error(f"Admin notification incomplete ({mode}) for {descriptions}")
+
+    async def _send_text(self, text, parse_mode):
+        await self._bot.send_message(
+            chat_id=self.chat_id,
+            text=text,
+            parse_mode=parse_mode,
+            rate_limit_args=PRIORITY_BACKGROUND
+        )
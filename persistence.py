@@ -0,0 +1,276 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from decimal import Decimal
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS persisted_data (
+    scope TEXT NOT NULL,
+    owner INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (scope, owner, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS persisted_conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+) WITHOUT ROWID;
+"""
+
+USER, CHAT, BOT = 'user', 'chat', 'bot'
+
+
+def _encode_default(value):
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    raise TypeError(f"Cannot persist value of type {type(value).__name__}")
+
+
+def _decode_hook(obj):
+    if '__decimal__' in obj and len(obj) == 1:
+        return Decimal(obj['__decimal__'])
+    return obj
+
+
+def dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_encode_default)
+
+
+def loads(text):
+    return json.loads(text, object_hook=_decode_hook)
+
+
+class SQLitePersistence(BasePersistence):
+    """PTB persistence backed by SQLite that only writes what changed
+
+    Each user/chat/bot data key is its own row. ``update_*_data`` diffs the
+    dict against the last persisted snapshot and stages only changed or
+    removed keys; all changes staged during one persistence run are committed
+    together in a single transaction off the event loop.
+
+    User and chat data are loaded lazily: ``get_user_data`` returns nothing at
+    startup and ``refresh_user_data`` fills a user's dict the first time an
+    update for that user arrives. Conversation states are small and are
+    loaded per handler at startup. The ``reload_*`` methods read one owner's
+    data or conversation again, for a cluster worker taking over a user whom
+    another worker served in the meantime.
+    """
+
+    def __init__(self, path, store_data=None, update_interval=5):
+        super().__init__(
+            store_data=store_data or PersistenceInput(callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+        self._snapshots = {}  # (scope, owner) -> {encoded key: encoded value} as last persisted
+        self._pending = {}    # (scope, owner, encoded key) -> encoded value, or None to delete
+        self._dropped = set()  # (scope, owner) whose rows must all be deleted
+        self._commit_task = None
+
+    # -- loading -------------------------------------------------------------
+
+    def _read(self, scope, owner):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, value FROM persisted_data WHERE scope = ? AND owner = ?",
+                (scope, owner)
+            ).fetchall()
+
+    async def _load(self, scope, owner):
+        rows = await asyncio.to_thread(self._read, scope, owner)
+        # An update staged while the rows were read already holds the newer snapshot
+        self._snapshots.setdefault((scope, owner), dict(rows))
+        return {loads(key): loads(value) for key, value in rows}
+
+    async def _refresh(self, scope, owner, data):
+        if (scope, owner) in self._snapshots:
+            return
+        loaded = await self._load(scope, owner)
+        # Keys set by the current update win over what was stored
+        for key, value in loaded.items():
+            data.setdefault(key, value)
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return await self._load(BOT, 0)
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, state FROM persisted_conversations WHERE name = ?", (name,)
+            ).fetchall()
+        return {tuple(loads(key)): loads(state) for key, state in rows}
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refresh(USER, user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh(CHAT, chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass  # loaded once at startup
+
+    async def _reload(self, scope, owner, data):
+        # Whatever this process holds or has yet to write for the owner is older than the store
+        self._snapshots.pop((scope, owner), None)
+        self._pending = {k: v for k, v in self._pending.items() if k[:2] != (scope, owner)}
+        loaded = await self._load(scope, owner)
+        data.clear()
+        data.update(loaded)
+
+    async def reload_user_data(self, user_id, user_data):
+        """Replace a user's data with the stored copy, e.g. after another process served the user"""
+        await self._reload(USER, user_id, user_data)
+
+    async def reload_chat_data(self, chat_id, chat_data):
+        """Replace a chat's data with the stored copy"""
+        await self._reload(CHAT, chat_id, chat_data)
+
+    def _read_conversation(self, name, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM persisted_conversations WHERE name = ? AND key = ?", (name, dumps(list(key)))
+            ).fetchone()
+        return None if row is None else loads(row[0])
+
+    async def reload_conversation(self, name, key):
+        """Stored state of one conversation, None if it has ended; drops any state still to be written"""
+        self._pending.pop(('conversation', name, dumps(list(key))), None)
+        return await asyncio.to_thread(self._read_conversation, name, key)
+
+    # -- staging changes -----------------------------------------------------
+
+    def _stage(self, scope, owner, data):
+        snapshot = self._snapshots.setdefault((scope, owner), {})
+        current = {dumps(key): dumps(value) for key, value in data.items()}
+
+        for key, value in current.items():
+            if snapshot.get(key) != value:
+                self._pending[(scope, owner, key)] = value
+        for key in snapshot.keys() - current.keys():
+            self._pending[(scope, owner, key)] = None
+
+        self._snapshots[(scope, owner)] = current
+
+    def _stage_drop(self, scope, owner):
+        self._snapshots[(scope, owner)] = {}
+        self._pending = {k: v for k, v in self._pending.items() if k[:2] != (scope, owner)}
+        self._dropped.add((scope, owner))
+
+    async def update_user_data(self, user_id, data):
+        self._stage(USER, user_id, data)
+        await self._commit_soon()
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage(CHAT, chat_id, data)
+        await self._commit_soon()
+
+    async def update_bot_data(self, data):
+        self._stage(BOT, 0, data)
+        await self._commit_soon()
+
+    async def update_callback_data(self, data):
+        pass  # callback data is not stored
+
+    async def drop_user_data(self, user_id):
+        self._stage_drop(USER, user_id)
+        await self._commit_soon()
+
+    async def drop_chat_data(self, chat_id):
+        self._stage_drop(CHAT, chat_id)
+        await self._commit_soon()
+
+    async def update_conversation(self, name, key, new_state):
+        encoded = dumps(list(key))
+        self._pending[('conversation', name, encoded)] = None if new_state is None else dumps(new_state)
+        await self._commit_soon()
+
+    # -- committing ----------------------------------------------------------
+
+    async def _commit_soon(self):
+        """Commit everything staged in this persistence run as one transaction"""
+        if self._commit_task is None:
+            self._commit_task = asyncio.ensure_future(self._commit())
+        await asyncio.shield(self._commit_task)
+
+    async def _commit(self):
+        # Let the other update_* coroutines of the same run stage their changes first
+        await asyncio.sleep(0)
+        self._commit_task = None
+        pending, self._pending = self._pending, {}
+        dropped, self._dropped = self._dropped, set()
+        if not (pending or dropped):
+            return
+        try:
+            await asyncio.to_thread(self._write, pending, dropped)
+        except Exception:
+            # Keep the changes for the next run; newer staged values take precedence
+            self._pending = {**pending, **self._pending}
+            self._dropped |= dropped
+            raise
+
+    def _write(self, pending, dropped):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "DELETE FROM persisted_data WHERE scope = ? AND owner = ?", list(dropped)
+                )
+                for (scope, owner, key), value in pending.items():
+                    if scope == 'conversation':
+                        if value is None:
+                            self._conn.execute(
+                                "DELETE FROM persisted_conversations WHERE name = ? AND key = ?", (owner, key)
+                            )
+                        else:
+                            self._conn.execute(
+                                "INSERT OR REPLACE INTO persisted_conversations (name, key, state) VALUES (?, ?, ?)",
+                                (owner, key, value)
+                            )
+                    elif value is None:
+                        self._conn.execute(
+                            "DELETE FROM persisted_data WHERE scope = ? AND owner = ? AND key = ?",
+                            (scope, owner, key)
+                        )
+                    else:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO persisted_data (scope, owner, key, value) VALUES (?, ?, ?, ?)",
+                            (scope, owner, key, value)
+                        )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.debug(f"Persisted {len(pending)} changed keys")
+
+    async def flush(self):
+        if self._commit_task is not None:
+            await self._commit_task
+        pending, self._pending = self._pending, {}
+        dropped, self._dropped = self._dropped, set()
+        if pending or dropped:
+            await asyncio.to_thread(self._write, pending, dropped)
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,176 @@
+import cProfile
+import functools
+import io
+import itertools
+import logging
+import pstats
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HANDLER_BLOCKING = metrics.REGISTRY.register(metrics.Histogram(
+    'lirakubot_handler_blocking_seconds',
+    'Longest stretch a handler ran on the event loop without yielding', ('handler',)
+))
+SLOW_HANDLERS = metrics.REGISTRY.register(metrics.Counter(
+    'lirakubot_slow_handlers_total', 'Handler runs that exceeded the latency budget', ('handler',)
+))
+
+
+class SlowHandlerProfiler:
+    """Profiling hook for handler callbacks
+
+    Each wrapped coroutine is driven step by step, so besides wall time the
+    hook knows how long every step ran on the event loop before yielding;
+    the longest step is the time the handler blocked every other update.
+
+    When a run exceeds ``budget`` seconds (wall or blocking) a warning is
+    logged with evidence:
+
+    * ``mode='stack'``: a watchdog thread samples the event loop thread's
+      stack once a single step has run longer than the budget, which points
+      straight at blocking calls such as a synchronous HTTP request.
+    * ``mode='cprofile'``: every ``sample_every``-th run is profiled with
+      cProfile (only while its own steps execute) and the top entries are
+      logged if that run was slow.
+    """
+
+    def __init__(self, budget=0.5, mode='stack', sample_every=10, stack_limit=25):
+        self.budget = budget
+        self.mode = mode
+        self.sample_every = sample_every
+        self.stack_limit = stack_limit
+        self._tokens = itertools.count()
+        self._runs = itertools.count()
+        self._lock = threading.Lock()
+        self._current = None  # (token, step start, thread id) of the step running now
+        self._samples = {}
+        self._watchdog = None
+
+    def instrument(self, application):
+        """Wrap every handler registered on the application"""
+        metrics.wrap_handlers(application, self.wrap)
+        if self.mode == 'stack' and self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name='slow-handler-watchdog', daemon=True)
+            self._watchdog.start()
+
+    def wrap(self, callback):
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            return await _ProfiledCall(self, name, update, callback(update, context))
+
+        return wrapper
+
+    # -- watchdog (stack mode) -----------------------------------------------
+
+    def _begin_step(self):
+        token = next(self._tokens)
+        with self._lock:
+            self._current = (token, time.perf_counter(), threading.get_ident())
+        return token
+
+    def _end_step(self, token):
+        with self._lock:
+            self._current = None
+            return self._samples.pop(token, None)
+
+    def _watch(self):
+        interval = max(self.budget / 4, 0.005)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                current = self._current
+                if current is None:
+                    continue
+                token, started, thread_id = current
+                if token in self._samples or time.perf_counter() - started < self.budget:
+                    continue
+                frame = sys._current_frames().get(thread_id)
+                if frame is not None:
+                    self._samples[token] = ''.join(traceback.format_stack(frame, limit=self.stack_limit))
+
+    # -- reporting -----------------------------------------------------------
+
+    def _should_cprofile(self):
+        return self.mode == 'cprofile' and next(self._runs) % self.sample_every == 0
+
+    def _report(self, name, update, wall, blocking, longest, stacks, profiler):
+        HANDLER_BLOCKING.observe(longest, handler=name)
+        if wall < self.budget and longest < self.budget:
+            return
+
+        SLOW_HANDLERS.inc(handler=name)
+        update_id = getattr(update, 'update_id', None)
+        message = (
+            f"Slow handler {name} (update {update_id}): wall {wall * 1000:.0f}ms, "
+            f"on-loop {blocking * 1000:.0f}ms, longest step {longest * 1000:.0f}ms"
+        )
+        if stacks:
+            message += "\nEvent loop was blocked at:\n" + "\n---\n".join(stacks)
+        if profiler is not None:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(15)
+            message += "\n" + out.getvalue()
+        logger.warning(message)
+
+
+class _ProfiledCall:
+    """Awaitable that drives a handler coroutine and times each step"""
+
+    __slots__ = ('profiler', 'name', 'update', 'coro')
+
+    def __init__(self, profiler, name, update, coro):
+        self.profiler = profiler
+        self.name = name
+        self.update = update
+        self.coro = coro
+
+    def __await__(self):
+        hook = self.profiler
+        coro = self.coro
+        cprof = cProfile.Profile() if hook._should_cprofile() else None
+        stacks = []
+        blocking = longest = 0.0
+        send_value, error = None, None
+        start = time.perf_counter()
+
+        try:
+            while True:
+                token = hook._begin_step()
+                step_start = time.perf_counter()
+                if cprof is not None:
+                    cprof.enable()
+                try:
+                    if error is not None:
+                        yielded = coro.throw(error)
+                    else:
+                        yielded = coro.send(send_value)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    if cprof is not None:
+                        cprof.disable()
+                    step = time.perf_counter() - step_start
+                    blocking += step
+                    longest = max(longest, step)
+                    sample = hook._end_step(token)
+                    if sample:
+                        stacks.append(sample)
+
+                try:
+                    send_value, error = (yield yielded), None
+                except GeneratorExit:
+                    coro.close()
+                    raise
+                except BaseException as e:
+                    send_value, error = None, e
+        finally:
+            hook._report(self.name, self.update, time.perf_counter() - start,
+                         blocking, longest, stacks, cprof)
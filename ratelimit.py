@@ -0,0 +1,158 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority classes passed as ``rate_limit_args``; lower is served first
+PRIORITY_INTERACTIVE = 0  # replies to the user who is waiting (default)
+PRIORITY_BACKGROUND = 1   # admin notifications, digests
+
+# Idle per-chat buckets are dropped once this many chats are tracked
+MAX_CHAT_BUCKETS = 10000
+
+RATE_LIMIT_WAITING = metrics.REGISTRY.register(metrics.Gauge(
+    'lirakubot_rate_limit_waiting', 'Bot API requests waiting for a send slot', ('priority',)
+))
+RATE_LIMIT_RETRIES = metrics.REGISTRY.register(metrics.Counter(
+    'lirakubot_rate_limit_retries_total', 'Bot API requests retried after a 429 response', ('endpoint',)
+))
+
+
+class TokenBucket:
+    """Token bucket whose waiters are served lowest priority value first, then FIFO"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._drainer = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self):
+        """Nobody is waiting and the bucket has refilled completely"""
+        self._refill()
+        return not self._waiters and self._tokens >= self.burst
+
+    def waiting(self, priority):
+        return sum(1 for p, _, future in self._waiters if p == priority and not future.done())
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE):
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._drainer is None:
+            self._drainer = asyncio.ensure_future(self._drain())
+        await future
+
+    async def _drain(self):
+        try:
+            while self._waiters:
+                self._refill()
+                if self._tokens < 1:
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+                    continue
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():  # skip callers that were cancelled while waiting
+                    self._tokens -= 1
+                    future.set_result(None)
+        finally:
+            self._drainer = None
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """Rate limiter for the bot's Bot API requests with priority classes
+
+    Requests that target a chat pass a global bucket (Telegram allows about
+    30 messages per second overall) and a bucket for that chat (about one
+    message per second in a private chat, 20 per minute in a group). Waiting
+    requests are granted in priority order, so a burst of admin
+    notifications sent with ``rate_limit_args=PRIORITY_BACKGROUND`` never
+    delays replies to users.
+
+    A 429 response pauses all requests for the ``retry_after`` Telegram asks
+    for, after which the request is retried up to ``max_retries`` times.
+    """
+
+    def __init__(self, overall_rate=30, chat_rate=1.0, chat_burst=3, group_rate=20 / 60,
+                 group_burst=3, max_retries=3):
+        self.overall_rate = overall_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self._overall = TokenBucket(overall_rate, overall_rate)
+        self._chats = {}
+        self._resume = asyncio.Event()
+        self._resume.set()
+
+    async def initialize(self):
+        for priority, label in ((PRIORITY_INTERACTIVE, 'interactive'), (PRIORITY_BACKGROUND, 'background')):
+            RATE_LIMIT_WAITING.set_function(lambda p=priority: self._overall.waiting(p), priority=label)
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle}
+            # Negative ids are groups and channels; string ids are channel usernames
+            group = isinstance(chat_id, str) or chat_id < 0
+            bucket = self._chats[chat_id] = (
+                TokenBucket(self.group_rate, self.group_burst) if group
+                else TokenBucket(self.chat_rate, self.chat_burst)
+            )
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = PRIORITY_INTERACTIVE if rate_limit_args is None else rate_limit_args
+        chat_id = data.get('chat_id')
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)
+
+        for attempt in range(self.max_retries + 1):
+            await self._resume.wait()
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire(priority)
+                await self._overall.acquire(priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    logger.error(f"{endpoint} still rate limited after {self.max_retries} retries")
+                    raise
+                RATE_LIMIT_RETRIES.inc(endpoint=endpoint)
+                logger.warning(f"Telegram rate limit on {endpoint}, pausing sends for {e.retry_after}s")
+                await self._pause(e.retry_after)
+
+    async def _pause(self, delay):
+        if self._resume.is_set():
+            self._resume.clear()
+            try:
+                await asyncio.sleep(delay + 0.1)
+            finally:
+                self._resume.set()
+        else:
+            await self._resume.wait()
@@ -0,0 +1,511 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from httpclient import HttpClient
+from metrics import outbound
+
+logger = logging.getLogger(__name__)
+
+LATEST_URL = "https://v6.exchangerate-api.com/v6/{api_key}/latest/{base}"
+QUOTA_URL = "https://v6.exchangerate-api.com/v6/{api_key}/quota"
+
+# Currencies that get a precomputed row/column in the cross-rate matrix
+MATRIX_CURRENCIES = ('IDR', 'TRY', 'USD', 'EUR')
+
+
+class RateTable:
+    """Immutable cross-rate matrix built from one ``/latest/{base}`` response
+
+    ``conversion_rates`` gives every currency relative to the base, so any
+    pair (including inverses) is ``rates[quote] / rates[base]``. The pairs
+    between ``MATRIX_CURRENCIES`` are precomputed into a flat ``array('d')``
+    so hot lookups are a dict hit plus an index.
+    """
+
+    __slots__ = ('base', 'fetched_at', '_index', '_rates', '_matrix_index', '_matrix')
+
+    def __init__(self, base, conversion_rates, fetched_at=None, matrix_currencies=MATRIX_CURRENCIES):
+        self.base = base
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+
+        self._index = {code: i for i, code in enumerate(conversion_rates)}
+        self._rates = array('d', (float(v) for v in conversion_rates.values()))
+
+        codes = [c for c in matrix_currencies if c in self._index]
+        self._matrix_index = {code: i for i, code in enumerate(codes)}
+        size = len(codes)
+        vector = [self._rates[self._index[c]] for c in codes]
+        self._matrix = array('d', (vector[j] / vector[i] for i in range(size) for j in range(size)))
+
+    @classmethod
+    def from_response(cls, data):
+        """Build a table from an exchangerate-api ``/latest`` JSON payload"""
+        if data.get('result') != 'success':
+            raise RuntimeError(f"Exchange rate API error: {data}")
+        return cls(data['base_code'], data['conversion_rates'])
+
+    def rate(self, base, quote):
+        """Units of ``quote`` for one unit of ``base``; None if either code is unknown"""
+        i = self._matrix_index.get(base)
+        j = self._matrix_index.get(quote)
+        if i is not None and j is not None:
+            return self._matrix[i * len(self._matrix_index) + j]
+
+        bi = self._index.get(base)
+        qi = self._index.get(quote)
+        if bi is None or qi is None:
+            return None
+        return self._rates[qi] / self._rates[bi]
+
+    def __contains__(self, code):
+        return code in self._index
+
+    def conversion_rates(self):
+        """Every currency relative to the base, as in the API response"""
+        return {code: self._rates[i] for code, i in self._index.items()}
+
+
+RATE_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_snapshots (
+    base TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    rates TEXT NOT NULL
+);
+"""
+
+
+class RateStore:
+    """Latest RateTable per base currency in SQLite
+
+    Every process that opens the same file sees the snapshot the others
+    fetched, so cluster workers share one rate (and one API quota) instead
+    of each fetching their own. Methods block; call them off the event loop.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(RATE_STORE_SCHEMA)
+
+    def save(self, table):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rate_snapshots (base, fetched_at, rates) VALUES (?, ?, ?)",
+                (table.base, table.fetched_at, json.dumps(table.conversion_rates()))
+            )
+
+    def load(self, base):
+        """Stored RateTable for ``base``, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at, rates FROM rate_snapshots WHERE base = ?", (base,)
+            ).fetchone()
+        if row is None:
+            return None
+        return RateTable(base, json.loads(row[1]), fetched_at=row[0])
+
+
+class QuotaTracker:
+    """Counts exchangerate-api requests against the monthly plan quota"""
+
+    def __init__(self, monthly_limit=1500, reset_day=1):
+        self.monthly_limit = monthly_limit
+        self.reset_day = reset_day
+        self.used = 0
+        self._next_reset = self._compute_next_reset(datetime.now(timezone.utc))
+
+    def _compute_next_reset(self, now):
+        day = min(self.reset_day, 28)
+        reset = now.replace(day=day, hour=0, minute=0, second=0, microsecond=0)
+        if reset <= now:
+            month = now.month % 12 + 1
+            year = now.year + (now.month == 12)
+            reset = reset.replace(year=year, month=month)
+        return reset
+
+    def _roll(self):
+        now = datetime.now(timezone.utc)
+        if now >= self._next_reset:
+            self.used = 0
+            self._next_reset = self._compute_next_reset(now)
+        return now
+
+    def record(self, count=1):
+        """Count upstream requests that were just made"""
+        self._roll()
+        self.used += count
+
+    def sync(self, plan_quota, requests_remaining, refresh_day_of_month):
+        """Adopt the numbers reported by the /quota endpoint"""
+        self.monthly_limit = plan_quota
+        self.used = max(plan_quota - requests_remaining, 0)
+        self.reset_day = refresh_day_of_month
+        self._next_reset = self._compute_next_reset(datetime.now(timezone.utc))
+
+    @property
+    def remaining(self):
+        self._roll()
+        return max(self.monthly_limit - self.used, 0)
+
+    def seconds_until_reset(self):
+        now = self._roll()
+        return max((self._next_reset - now).total_seconds(), 0.0)
+
+    def as_dict(self):
+        """Quota usage summary for health/monitoring output"""
+        remaining = self.remaining
+        return {
+            "used": self.used,
+            "limit": self.monthly_limit,
+            "remaining": remaining,
+            "used_percent": round(100 * self.used / self.monthly_limit, 1) if self.monthly_limit else 100.0,
+            "resets_at": self._next_reset.isoformat(),
+        }
+
+
+class CircuitBreaker:
+    """Fails fast after repeated upstream failures, then lets single probes through
+
+    Closed, calls pass and ``failure_threshold`` consecutive failures open it.
+    Open, calls are refused until ``reset_timeout`` seconds have passed; the
+    next call is then let through as a probe (half-open). A successful probe
+    closes the breaker, a failed one opens it again with the timeout doubled,
+    up to ``max_reset_timeout``.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0, max_reset_timeout=600.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._timeout = reset_timeout
+        self._retry_at = 0.0
+
+    def allow(self):
+        """Whether a call may go upstream now; moves an expired open breaker to half-open"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() >= self._retry_at:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def retry_in(self):
+        """Seconds until an open breaker lets a probe through"""
+        return max(self._retry_at - time.monotonic(), 0.0) if self.state == self.OPEN else 0.0
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._timeout = self.reset_timeout
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+        elif self.failures < self.failure_threshold:
+            return
+        self.state = self.OPEN
+        self._retry_at = time.monotonic() + self._timeout
+
+
+class RateService:
+    """Async exchange-rate lookups backed by an in-memory TTL cache
+
+    One ``/latest/{base}`` call fills a RateTable that answers every pair, and
+    the table is cached for ``ttl`` seconds. A cold table is fetched once no
+    matter how many handlers ask for it at the same time (concurrent callers
+    await the same in-flight fetch). An expired table keeps being served while
+    a single background refresh revalidates it.
+
+    With a ``store`` (RateStore), fetched tables are saved to it and a
+    refresh first adopts a stored table that another process fetched within
+    ``ttl``, so only a stale store costs an API request. The store also holds
+    the last good table across restarts; ``load_stored`` at startup lets the
+    bot quote before its first fetch.
+
+    Fetches go through a CircuitBreaker. While it is open, refreshes return
+    the current table at once instead of waiting on a dead API, and a
+    background probe retries it. Tables older than ``max_age`` are never
+    quoted from.
+    """
+
+    def __init__(self, api_key, ttl=1800, timeout=10, base='IDR', store=None, max_age=24 * 3600,
+                 breaker=None, http=None):
+        self.api_key = api_key
+        self.ttl = ttl
+        self.timeout = timeout
+        self.http = http or HttpClient(timeout=timeout)
+        self.base = base
+        self.store = store
+        self.max_age = max_age
+        self.breaker = breaker or CircuitBreaker()
+        self.quota = QuotaTracker()
+        self.last_access = 0.0
+        self._table = None
+        self._loaded_at = 0.0
+        self._inflight = None
+        self._probe = None
+
+    @property
+    def table(self):
+        """Current RateTable snapshot (may be stale or None)"""
+        return self._table
+
+    def current(self):
+        """Return the cached RateTable without waiting, refreshing it in the background when stale
+
+        None if no table was loaded yet or the table is older than ``max_age``.
+        """
+        table = self._table
+        self.last_access = time.monotonic()
+        if table is None:
+            return None
+        age = self.last_access - self._loaded_at
+        # Stale-while-revalidate: answer now, refresh in the background. While the
+        # circuit is open the scheduled probe refreshes, not every caller
+        if age >= self.ttl and not self.breaker.retry_in():
+            self.refresh()
+        return table if age <= self.max_age else None
+
+    async def get_table(self):
+        """Return the current RateTable, or None if no table recent enough to quote from is available"""
+        table = self.current()
+        if table is not None:
+            return table
+        table = await asyncio.shield(self.refresh())
+        return table if table is not None and self.age <= self.max_age else None
+
+    def refresh(self):
+        """Start a refresh unless one is already running; returns the shared task"""
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._fetch_and_store())
+            self._inflight.add_done_callback(self._clear_inflight)
+        return self._inflight
+
+    def _clear_inflight(self, _):
+        self._inflight = None
+
+    @property
+    def age(self):
+        """Seconds since the current table was loaded (inf if never)"""
+        return time.monotonic() - self._loaded_at if self._table else float('inf')
+
+    async def sync_quota(self):
+        """Load the real quota usage from the /quota endpoint (best effort)"""
+        try:
+            data = await self._fetch_quota()
+            self.quota.sync(data['plan_quota'], data['requests_remaining'], data['refresh_day_of_month'])
+            logger.info(f"Exchange rate quota synced: {self.quota.as_dict()}")
+        except Exception as e:
+            logger.warning(f"Could not sync exchange rate quota: {e}")
+
+    async def _fetch_quota(self):
+        with outbound('exchange_api', 'quota'):
+            response = await self.http.get(QUOTA_URL.format(api_key=self.api_key))
+            data = response.json()
+        if data.get('result') != 'success':
+            raise RuntimeError(f"Exchange rate API error: {data}")
+        return data
+
+    def _adopt(self, table):
+        self._table = table
+        # Age counts from the original fetch, not from when this process loaded it
+        self._loaded_at = time.monotonic() - max(time.time() - table.fetched_at, 0.0)
+
+    def _newer(self, table):
+        return table is not None and (self._table is None or table.fetched_at > self._table.fetched_at)
+
+    async def load_stored(self):
+        """Adopt the stored table if it is newer than the current one; True if adopted"""
+        if self.store is None:
+            return False
+        try:
+            stored = await asyncio.to_thread(self.store.load, self.base)
+        except Exception as e:
+            logger.warning(f"Could not read stored exchange rates: {e}")
+            return False
+        if not self._newer(stored):
+            return False
+        self._adopt(stored)
+        return True
+
+    async def _fetch_and_store(self):
+        if await self.load_stored() and self.age < self.ttl:
+            return self._table
+        if not self.breaker.allow():
+            return self._table
+
+        self.quota.record()
+        try:
+            table = await self._fetch()
+        except Exception as e:
+            self.breaker.record_failure()
+            logger.error(f"Error fetching exchange rates for {self.base}: {e}")
+            if self.breaker.state == CircuitBreaker.OPEN:
+                logger.warning(f"Exchange rate API circuit open, next probe in {self.breaker.retry_in():.0f}s")
+                self._schedule_probe()
+            return self._table
+
+        if self.breaker.state != CircuitBreaker.CLOSED:
+            logger.info("Exchange rate API recovered, circuit closed")
+        self.breaker.record_success()
+        self._table = table
+        self._loaded_at = time.monotonic()
+        if self.store is not None:
+            try:
+                await asyncio.to_thread(self.store.save, table)
+            except Exception as e:
+                logger.warning(f"Could not store exchange rates: {e}")
+        return table
+
+    def _schedule_probe(self):
+        if self._probe is None or self._probe.done():
+            self._probe = asyncio.ensure_future(self._probe_later())
+
+    async def _probe_later(self):
+        """Retry the API once the open circuit allows it, without waiting for a user to ask"""
+        await asyncio.sleep(self.breaker.retry_in())
+        self.refresh()
+
+    def close(self):
+        """Cancel a pending background probe"""
+        if self._probe is not None:
+            self._probe.cancel()
+            self._probe = None
+
+    async def _fetch(self):
+        """Request to exchangerate-api over the shared HTTP client"""
+        url = LATEST_URL.format(api_key=self.api_key, base=self.base)
+        with outbound('exchange_api', 'latest'):
+            response = await self.http.get(url)
+            return RateTable.from_response(response.json())
+
+
+class SnapshotCache:
+    """Value derived from a RateService table, built once per table snapshot
+
+    ``build(table)`` runs the first time the value is needed for a snapshot;
+    later calls return it without touching the table until a refresh stores
+    a new snapshot, which invalidates the cached value.
+    """
+
+    def __init__(self, service, build):
+        self.service = service
+        self.build = build
+        self._table = None
+        self._value = None
+
+    async def get(self):
+        table = self.service.current()
+        if table is None:
+            table = await self.service.get_table()
+            if table is None:
+                return None
+        return self._for(table)
+
+    def peek(self):
+        """Value for the current table without waiting; None while no usable table is loaded"""
+        table = self.service.current()
+        return None if table is None else self._for(table)
+
+    def _for(self, table):
+        if table is not self._table:
+            self._value = self.build(table)
+            self._table = table
+        return self._value
+
+
+class RateRefresher:
+    """JobQueue job that keeps the RateService warm within the API quota
+
+    Each run refreshes the table and reschedules itself. The base interval
+    spreads the remaining quota evenly over the time left until it resets,
+    so overspending early automatically slows later refreshes. During active
+    hours (local time) with recent user traffic the interval is shortened,
+    and it is stretched while the bot is idle.
+
+    With ``follow=True`` (cluster workers other than the leader) the job
+    never spends quota itself: every ``poll_interval`` seconds it adopts the
+    table the leader saved to the service's RateStore.
+    """
+
+    JOB_NAME = 'rate_refresh'
+
+    def __init__(self, service, active_hours=(7, 23), utc_offset_hours=7,
+                 active_factor=0.5, idle_factor=3.0, idle_after=3600,
+                 min_interval=600, max_interval=6 * 3600, reserve=50,
+                 follow=False, poll_interval=60):
+        self.service = service
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.active_hours = active_hours
+        self.tz = timezone(timedelta(hours=utc_offset_hours))
+        self.active_factor = active_factor
+        self.idle_factor = idle_factor
+        self.idle_after = idle_after
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.reserve = reserve  # requests kept back for cold starts and manual use
+        self.next_interval_seconds = None
+
+    def start(self, job_queue):
+        """Schedule the first refresh immediately"""
+        # On-demand revalidation becomes a fallback for when this job falls behind
+        ttl = max(self.service.ttl, 2 * self.max_interval)
+        if ttl != self.service.ttl:
+            logger.info(
+                f"Rate cache TTL raised from {self.service.ttl:.0f}s to {ttl:.0f}s; "
+                f"the refresh job paces requests to the API quota"
+            )
+            self.service.ttl = ttl
+        job_queue.run_once(self._run, 0, name=self.JOB_NAME, data={'first': True})
+
+    def is_active(self):
+        start, end = self.active_hours
+        hour = datetime.now(self.tz).hour
+        recently_used = time.monotonic() - self.service.last_access < self.idle_after
+        return start <= hour < end and recently_used
+
+    def next_interval(self):
+        """Seconds until the next refresh, derived from the remaining quota"""
+        quota = self.service.quota
+        budget = max(quota.remaining - self.reserve, 0)
+        if budget == 0:
+            return quota.seconds_until_reset() or self.max_interval
+
+        interval = quota.seconds_until_reset() / budget
+        interval *= self.active_factor if self.is_active() else self.idle_factor
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    async def _run(self, context):
+        if self.follow:
+            if await self.service.load_stored():
+                logger.info("Exchange rates updated from the shared rate store")
+            context.job_queue.run_once(self._run, self.poll_interval, name=self.JOB_NAME)
+            return
+
+        if context.job.data and context.job.data.get('first'):
+            await self.service.sync_quota()
+
+        # The startup warm-up (or another worker) may have just loaded a fresh table
+        if self.service.age >= self.min_interval:
+            await self.service.refresh()
+
+        self.next_interval_seconds = self.next_interval()
+        context.job_queue.run_once(self._run, self.next_interval_seconds, name=self.JOB_NAME)
+        logger.info(
+            f"Exchange rates refreshed; next refresh in {self.next_interval_seconds:.0f}s, "
+            f"quota used {self.service.quota.used}/{self.service.quota.monthly_limit}"
+        )
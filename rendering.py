@@ -0,0 +1,51 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+def format_idr(amount):
+    """Rupiah with dot thousands separators, e.g. ``Rp1.234.567``"""
+    if type(amount) is not int:
+        amount = round(amount)  # Same half-even rounding as '{:,.0f}'
+    return f"Rp{amount:,}".replace(',', '.')
+
+
+def format_currency(amount, currency='IDR'):
+    """Format currency display"""
+    if currency == 'IDR':
+        return format_idr(amount)
+    elif currency == 'TRY':
+        return f"₺{amount:,.2f}".replace(',', '.')
+    return f"{amount:,.2f}"
+
+
+# Same characters as telegram.helpers.escape_markdown(version=1), without a regex substitution per call
+_MARKDOWN_ESCAPES = str.maketrans({char: '\\' + char for char in '_*`['})
+
+
+def markdown_text(text):
+    """User-supplied text for a legacy Markdown message, so ``_`` or ``*`` in a name is not markup"""
+    return str(text).translate(_MARKDOWN_ESCAPES)
+
+
+def code_text(text):
+    """User-supplied text for inside a legacy Markdown code span, where a backtick cannot be escaped"""
+    return str(text).replace('`', "'")
+
+
+def _keyboard(*buttons):
+    """One button per row; PTB freezes the markup, so a single instance is shared by every message"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=data)] for text, data in buttons])
+
+
+_BACK = ("🔙 Kembali", "back")
+_MAIN_MENU = ("🏠 Menu Utama", "main_menu")
+
+MAIN_KEYBOARD = _keyboard(
+    ("💸 Beli Lira", "buy_lira"),
+    ("💵 Jual Lira", "sell_lira"),
+    ("💱 Lihat Simulasi Kurs", "simulation"),
+    ("👤 Kontak Admin", "contact_admin"),
+)
+BACK_MENU_KEYBOARD = _keyboard(_BACK, _MAIN_MENU)
+CONFIRMATION_KEYBOARD = _keyboard(("✅ Data Sudah Benar", "confirm_transaction"), _BACK, _MAIN_MENU)
+PAYMENT_KEYBOARD = _keyboard(("✅ Saya sudah bayar", "payment_sent"), _BACK, _MAIN_MENU)
+SELL_SENT_KEYBOARD = _keyboard(("✅ Saya sudah kirim", "sell_sent"), _BACK, _MAIN_MENU)
@@ -0,0 +1,299 @@
+import asyncio
+import importlib.util
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+
+def _installed(*modules):
+    try:
+        return all(importlib.util.find_spec(module) is not None for module in modules)
+    except ModuleNotFoundError:  # parent package of a dotted name is missing
+        return False
+
+
+# Google Sheets dependencies are slow to import, so SheetsClient imports them on first use
+SHEETS_AVAILABLE = _installed('gspread', 'requests', 'google.auth', 'google.oauth2')
+if not SHEETS_AVAILABLE:
+    print("⚠️ Google Sheets dependencies not found. Install with: pip install gspread google-auth")
+
+from httpclient import HttpClient
+from metrics import outbound
+
+logger = logging.getLogger(__name__)
+
+# Refresh the access token this long before it expires
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+VALUES_APPEND_URL = "https://sheets.googleapis.com/v4/spreadsheets/{spreadsheet_id}/values/{range}:append"
+
+
+def sheet_range(title):
+    """A1 range covering a whole worksheet, e.g. ``'Sheet1'``"""
+    return "'" + title.replace("'", "''") + "'"
+
+# Client errors that can pass on a retry: expired token, sheet reopened by name, timeout, rate limit
+RETRYABLE_STATUSES = {401, 404, 408, 429}
+
+_STOP = object()
+
+
+def permanent_error(error):
+    """Whether a failed Sheets call would fail the same way on every retry, e.g. 400 or 403"""
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in RETRYABLE_STATUSES
+
+
+class SheetsClient:
+    """Long-lived Google Sheets connection
+
+    Credentials are loaded and authorized once, and the gspread client (and
+    its pooled HTTP session) is reused for every call. Spreadsheets are
+    opened by name only once, since ``gc.open`` runs a Drive search, and
+    worksheet handles are cached by ``(spreadsheet, index)``.
+
+    Row appends, the only call made per transaction, skip gspread and go
+    straight to ``values:append`` on the shared async HttpClient.
+    """
+
+    def __init__(self, service_account_file, scopes, http=None):
+        self.service_account_file = service_account_file
+        self.scopes = scopes
+        self.http = http or HttpClient()
+        self._creds = None
+        self._client = None
+        self._token_session = None
+        self._spreadsheets = {}  # name -> gspread.Spreadsheet
+        self._worksheets = {}    # (name, index) -> gspread.Worksheet
+        self._headers_ok = set()  # (name, index) keys whose header row is known to exist
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return SHEETS_AVAILABLE
+
+    def client(self):
+        """Return the authorized gspread client, creating it on first use"""
+        with self._lock:
+            if self._client is None:
+                import gspread
+                import requests
+                from google.oauth2.service_account import Credentials
+
+                self._creds = Credentials.from_service_account_file(
+                    self.service_account_file, scopes=self.scopes
+                )
+                # Separate plain session for token refreshes, reused across refreshes
+                self._token_session = requests.Session()
+                self._refresh_token()
+                self._client = gspread.authorize(self._creds)
+                logger.info("Google Sheets client authorized")
+            elif self._token_expiring():
+                self._refresh_token()
+            return self._client
+
+    def _token_expiring(self):
+        expiry = self._creds.expiry
+        if not self._creds.token or expiry is None:
+            return True
+        # google-auth stores expiry as a naive UTC datetime
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return expiry - now <= TOKEN_REFRESH_MARGIN
+
+    def _refresh_token(self):
+        from google.auth.transport.requests import Request
+        self._creds.refresh(Request(session=self._token_session))
+
+    def spreadsheet(self, name):
+        """Return the cached spreadsheet handle, opening it by name once"""
+        gc = self.client()
+        spreadsheet = self._spreadsheets.get(name)
+        if spreadsheet is None:
+            with self._lock:
+                spreadsheet = self._spreadsheets.get(name)
+                if spreadsheet is None:
+                    with outbound('google_sheets', 'open'):
+                        spreadsheet = gc.open(name)
+                    self._spreadsheets[name] = spreadsheet
+        return spreadsheet
+
+    def worksheet(self, name, index=0):
+        """Return the cached worksheet handle (``index=0`` is ``sheet1``)"""
+        key = (name, index)
+        worksheet = self._worksheets.get(key)
+        if worksheet is None:
+            worksheet = self.spreadsheet(name).get_worksheet(index)
+            self._worksheets[key] = worksheet
+        else:
+            # Keep the token fresh even when every handle is cached
+            self.client()
+        return worksheet
+
+    def ensure_headers(self, name, headers, index=0):
+        """Write the header row if the sheet is empty; checked once per worksheet
+
+        Only cell A1 is read, so the cost does not grow with the number of rows.
+        """
+        key = (name, index)
+        worksheet = self.worksheet(name, index)
+        if key in self._headers_ok:
+            return worksheet
+
+        with outbound('google_sheets', 'header_check'):
+            has_headers = bool(worksheet.acell('A1').value)
+        if not has_headers:
+            worksheet.append_row(headers)
+            logger.info(f"Header row written to '{name}'")
+        self._headers_ok.add(key)
+        return worksheet
+
+    async def append_rows(self, name, rows, headers, index=0):
+        """Append rows to the worksheet (header row ensured first) with one ``values:append`` request"""
+        key = (name, index)
+        worksheet = self._worksheets.get(key)
+        if worksheet is None or key not in self._headers_ok or self._token_expiring():
+            # Opening the sheet and refreshing the token are blocking gspread/google-auth calls
+            worksheet = await asyncio.to_thread(self.ensure_headers, name, headers, index)
+
+        url = VALUES_APPEND_URL.format(
+            spreadsheet_id=worksheet.spreadsheet_id, range=quote(sheet_range(worksheet.title), safe='')
+        )
+        with outbound('google_sheets', 'append_rows'):
+            response = await self.http.post(
+                url,
+                params={'valueInputOption': 'RAW'},
+                json={'values': rows, 'majorDimension': 'ROWS'},
+                headers={'Authorization': f"Bearer {self._creds.token}"}
+            )
+            if response.status_code == 401:
+                self._creds.token = None  # refreshed before the retry
+            elif response.status_code == 404:
+                self.invalidate()  # sheet renamed or deleted; reopen it on the retry
+            response.raise_for_status()
+
+    def invalidate(self):
+        """Drop cached handles, e.g. after the spreadsheet was renamed or shared anew"""
+        with self._lock:
+            self._spreadsheets.clear()
+            self._worksheets.clear()
+            self._headers_ok.clear()
+
+
+class SheetWriteQueue:
+    """Write-behind queue that appends rows to a worksheet in batches
+
+    ``put`` returns immediately; a background worker collects rows until
+    ``batch_size`` is reached or ``flush_interval`` seconds have passed since
+    the first queued row, then writes them with one ``SheetsClient.append_rows``
+    call. Failed batches are retried with exponential backoff.
+    ``stop`` drains everything still queued before returning.
+    """
+
+    def __init__(self, client, spreadsheet_name, headers, batch_size=20, flush_interval=2.0,
+                 base_backoff=1.0, max_backoff=60.0, shutdown_attempts=3, on_written=None):
+        self.client = client
+        self.on_written = on_written  # called (in a worker thread) with the entry ids of each written batch
+        self.spreadsheet_name = spreadsheet_name
+        self.headers = headers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.shutdown_attempts = shutdown_attempts
+        self._queue = asyncio.Queue()
+        self._task = None
+        self._stopping = None  # asyncio.Event, set once stop() is called
+
+    def put(self, row, entry_id=None):
+        """Queue one row for writing; never blocks"""
+        self._queue.put_nowait((entry_id, row))
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush all queued rows and stop the worker"""
+        if self._task is None:
+            return
+        # Also cuts short the backoff of a batch that is currently being retried
+        self._stopping.set()
+        self._queue.put_nowait(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch, final=stopping)
+
+        # Drain anything that was queued behind the stop marker
+        leftover = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                leftover.append(item)
+        for i in range(0, len(leftover), self.batch_size):
+            await self._flush(leftover[i:i + self.batch_size], final=True)
+
+    async def _flush(self, batch, final=False):
+        attempt = 0
+        while True:
+            try:
+                await self._append(batch)
+                return True
+            except Exception as e:
+                if permanent_error(e):
+                    # Retrying would block every later row; journaled rows stay unsynced for a later replay
+                    logger.error(f"Sheets rejected {len(batch)} rows, not retrying: {e}")
+                    return False
+                attempt += 1
+                stopping = final or self._stopping.is_set()
+                if stopping and attempt >= self.shutdown_attempts:
+                    logger.error(f"Giving up on {len(batch)} sheet rows during shutdown: {e}")
+                    return False
+                delay = self.base_backoff if stopping else min(self.base_backoff * 2 ** (attempt - 1), self.max_backoff)
+                logger.warning(f"Error saving {len(batch)} rows to sheets (attempt {attempt}), retrying in {delay:.0f}s: {e}")
+                if stopping:
+                    await asyncio.sleep(delay)
+                    continue
+                try:
+                    # Wake up early if shutdown starts while backing off
+                    await asyncio.wait_for(self._stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _append(self, batch):
+        await self.client.append_rows(self.spreadsheet_name, [row for _, row in batch], self.headers)
+        if self.on_written:
+            # The rows are already in the sheet; a failure here must not trigger a re-append
+            try:
+                await asyncio.to_thread(self.on_written, [entry_id for entry_id, _ in batch if entry_id is not None])
+            except Exception as e:
+                logger.error(f"Error recording written sheet rows: {e}")
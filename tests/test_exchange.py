@@ -0,0 +1,67 @@
+import unittest
+from decimal import Decimal
+
+from exchange import parse_amount, parse_idr, parse_try
+
+
+class ParseAmountTest(unittest.TestCase):
+
+    def test_decimal_separator(self):
+        self.assertEqual(parse_amount('100,5'), Decimal('100.5'))
+        self.assertEqual(parse_amount('100.50'), Decimal('100.50'))
+        self.assertEqual(parse_amount('1000.00'), Decimal('1000.00'))
+        self.assertEqual(parse_amount('2500,50'), Decimal('2500.50'))
+
+    def test_thousands_separator(self):
+        self.assertEqual(parse_amount('1.000'), Decimal('1000'))
+        self.assertEqual(parse_amount('1,000'), Decimal('1000'))
+        self.assertEqual(parse_amount('500.000'), Decimal('500000'))
+        self.assertEqual(parse_amount('1.000.000'), Decimal('1000000'))
+
+    def test_both_separators(self):
+        self.assertEqual(parse_amount('1,000.00'), Decimal('1000.00'))
+        self.assertEqual(parse_amount('1.000,50'), Decimal('1000.50'))
+        self.assertEqual(parse_amount('500.000,00'), Decimal('500000.00'))
+
+    def test_rejected(self):
+        for text in ('1.5.5', '1,5,5', '1.000.5', '1e5', '1E5', 'NaN', 'Infinity', '-5', '+5',
+                     '', 'abc', '1 000', '10,00,000', '1000.000', ',5', '0,001'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_amount(text)
+
+
+class ParseIdrTest(unittest.TestCase):
+
+    def test_whole_rupiah(self):
+        self.assertEqual(parse_idr('500000'), 500000)
+        self.assertEqual(parse_idr('500.000'), 500000)
+        self.assertEqual(parse_idr('1,000,000'), 1000000)
+
+    def test_zero_fraction_is_dropped(self):
+        self.assertEqual(parse_idr('500.000,00'), 500000)
+        self.assertEqual(parse_idr('1000.00'), 1000)
+        self.assertEqual(parse_idr('1,000.00'), 1000)
+
+    def test_fraction_is_rejected(self):
+        for text in ('2500,50', '100.5', '1.000,50'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_idr(text)
+
+
+class ParseTryTest(unittest.TestCase):
+
+    def test_amounts(self):
+        self.assertEqual(parse_try(' 250 '), Decimal('250'))
+        self.assertEqual(parse_try('1.000,50'), Decimal('1000.50'))
+
+    def test_rejected(self):
+        for text in ('1.5.5', '1e5'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_try(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
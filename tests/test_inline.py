@@ -0,0 +1,44 @@
+import unittest
+from decimal import Decimal
+
+from inline import parse_query
+
+MIN_BUY = 100000
+
+
+class ParseQueryTest(unittest.TestCase):
+
+    def test_bare_whole_number(self):
+        self.assertEqual(parse_query('500000', MIN_BUY), ('buy', 500000))
+        self.assertEqual(parse_query('500.000', MIN_BUY), ('buy', 500000))
+        self.assertEqual(parse_query('250', MIN_BUY), ('sell', Decimal('250.00')))
+
+    def test_bare_number_with_fraction_is_lira(self):
+        self.assertEqual(parse_query('1000.00', MIN_BUY), ('sell', Decimal('1000.00')))
+        self.assertEqual(parse_query('2500,50', MIN_BUY), ('sell', Decimal('2500.50')))
+        self.assertEqual(parse_query('1,000.00', MIN_BUY), ('sell', Decimal('1000.00')))
+        self.assertEqual(parse_query('150000,75', MIN_BUY), ('sell', Decimal('150000.75')))
+
+    def test_bare_rupiah_with_zero_fraction(self):
+        self.assertEqual(parse_query('500.000,00', MIN_BUY), ('buy', 500000))
+
+    def test_rupiah_hint(self):
+        self.assertEqual(parse_query('Rp 500.000', MIN_BUY), ('buy', 500000))
+        self.assertEqual(parse_query('Rp 500.000,00', MIN_BUY), ('buy', 500000))
+        self.assertEqual(parse_query('500000 IDR', MIN_BUY), ('buy', 500000))
+        self.assertIsNone(parse_query('Rp 2500,50', MIN_BUY))
+        self.assertIsNone(parse_query('Rp 50.000', MIN_BUY))
+
+    def test_lira_hint(self):
+        self.assertEqual(parse_query('250 TL', MIN_BUY), ('sell', Decimal('250.00')))
+        self.assertEqual(parse_query('₺1.000,50', MIN_BUY), ('sell', Decimal('1000.50')))
+        self.assertEqual(parse_query('lira 500000', MIN_BUY), ('sell', Decimal('500000.00')))
+
+    def test_invalid(self):
+        for text in ('abc', 'Rp 500 TL', '1.5.5', '1e5', '0', '0,001 TL'):
+            with self.subTest(text=text):
+                self.assertIsNone(parse_query(text, MIN_BUY))
+
+
+if __name__ == '__main__':
+    unittest.main()
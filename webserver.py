@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024  # Telegram updates are far smaller than this
+READ_TIMEOUT = 30
+
+Request = namedtuple('Request', 'method path headers body')
+Response = namedtuple('Response', 'status content_type body')
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error',
+           502: 'Bad Gateway'}
+
+
+def text_response(text, status=200):
+    return Response(status, 'text/plain; charset=utf-8', text.encode())
+
+
+def json_response(data, status=200):
+    return Response(status, 'application/json', json.dumps(data).encode())
+
+
+class WebServer:
+    """Minimal asyncio HTTP/1.1 server for the webhook, health and status routes
+
+    Runs on the bot's own event loop, so no extra thread or framework is
+    needed. Handlers are ``async def handler(request) -> Response`` and are
+    registered per ``(method, path)``. Connections are kept alive, which is
+    what Telegram's webhook delivery uses.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._routes = {}
+        self._server = None
+
+    def route(self, method, path, handler):
+        self._routes[(method, path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT)
+                except ValueError:
+                    # Malformed request, e.g. a header line over the stream limit
+                    request = text_response('Bad Request', 400)
+                if request is None:
+                    break
+                if isinstance(request, Response):
+                    await self._write(writer, request, keep_alive=False)
+                    break
+
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                await self._write(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            return text_response('Bad Request', 400)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = headers.get('content-length') or '0'
+        if not length.isdigit():
+            return text_response('Bad Request', 400)
+        length = int(length)
+        if length > MAX_BODY_SIZE:
+            return text_response('Payload Too Large', 413)
+        body = await reader.readexactly(length) if length else b''
+
+        path = target.split('?', 1)[0]
+        return Request(method.upper(), path, headers, body)
+
+    async def _dispatch(self, request):
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return text_response('Method Not Allowed', 405)
+            return text_response('Not Found', 404)
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Error handling {request.method} {request.path}: {e}")
+            return text_response('Internal Server Error', 500)
+
+    async def _write(self, writer, response, keep_alive):
+        head = (
+            f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + response.body)
+        await writer.drain()